@@ -0,0 +1,292 @@
+"""
+Нагрузочные замеры бота без сети: настоящий dp из main.py,
+синтетические апдейты и фейковая сессия Bot API.
+
+    python bench.py                     # все замеры
+    python bench.py guess leaderboard   # выборочно
+    python bench.py -n 20000 --seed 7 --storage sqlite
+    python bench.py webhook             # фейковый Telegram шлёт апдейты в вебхук
+
+Работает во временной папке со сгенерированным словарём —
+файлы бота (words.txt, scores.json, ...) не трогает.
+Печатает ops/sec и p50/p99 на одну операцию.
+"""
+import os
+import sys
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import itertools
+from datetime import datetime
+from time import perf_counter
+
+CHAT = -100
+WORDS = 40_000
+PLAYERS = 10_000
+
+# =========================================================
+#                  ФЕЙКОВЫЙ BOT API
+# =========================================================
+def make_fake_session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage, EditMessageText, GetChatMember, GetChatAdministrators
+    from aiogram.types import Message, Chat, User, ChatMemberMember, ChatMemberOwner
+
+    class FakeSession(BaseSession):
+        """Отвечает на запросы сразу, ничего не отправляя; считает вызовы."""
+
+        def __init__(self):
+            super().__init__()
+            self.ids = itertools.count(1_000_000)
+            self.calls = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if isinstance(method, (SendMessage, EditMessageText)):
+                return Message(message_id=next(self.ids), date=datetime.now(),
+                               chat=Chat(id=method.chat_id or CHAT, type="supergroup"), text=method.text)
+            if isinstance(method, GetChatMember):
+                uid = method.user_id if isinstance(method.user_id, int) else 0
+                return ChatMemberMember(user=User(id=uid, is_bot=False, first_name=f"u{uid}"))
+            if isinstance(method, GetChatAdministrators):
+                return [ChatMemberOwner(user=User(id=1, is_bot=False, first_name="admin"), is_anonymous=False)]
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            if False:
+                yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+_ids = itertools.count(1)
+
+def make_message(text: str, uid: int):
+    from aiogram.types import Update, Message, Chat, User
+    m = Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=CHAT, type="supergroup"),
+                from_user=User(id=uid, is_bot=False, first_name=f"u{uid}"), text=text)
+    return Update(update_id=next(_ids), message=m)
+
+def make_callback(data: str, uid: int):
+    from aiogram.types import Update, Message, Chat, User, CallbackQuery
+    m = Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=CHAT, type="supergroup"), text="x")
+    return Update(update_id=next(_ids), callback_query=CallbackQuery(
+        id=str(next(_ids)), from_user=User(id=uid, is_bot=False, first_name=f"u{uid}"),
+        chat_instance="bench", message=m, data=data))
+
+# =========================================================
+#                       ЗАМЕРЫ
+# =========================================================
+def report(name: str, samples: list[float]):
+    samples.sort()
+    total = sum(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<28} {len(samples):>7} ops  {len(samples) / total:>11,.0f} ops/s"
+          f"  p50 {p50 * 1e6:>9.1f} µs  p99 {p99 * 1e6:>9.1f} µs")
+
+async def timed(samples: list[float], coro):
+    t = perf_counter()
+    await coro
+    samples.append(perf_counter() - t)
+
+async def bench_guess(main, n: int, rnd: random.Random):
+    """on_guess через dp: промахи, «почти» и верные ответы."""
+    dp, bot = main.dp, main.bot
+    s = main.sessions[main.HOME]
+    await dp.feed_update(bot, make_message("/startgame", uid=2))
+
+    words = main.dictionary.words
+    misses = [make_message(rnd.choice(words), uid=10 + i % 500) for i in range(n)]
+    samples = []
+    for u in misses:
+        if not s.active:
+            await dp.feed_update(bot, make_message("/startgame", uid=2))
+        await timed(samples, dp.feed_update(bot, u))
+    report("guess: miss", samples)
+
+    samples = []
+    for i in range(max(1, n // 10)):
+        u = make_message(s.word, uid=10 + i % 500)
+        await timed(samples, dp.feed_update(bot, u))
+    report("guess: hit (+ new round)", samples)
+
+async def bench_leaderboard(main, n: int, rnd: random.Random):
+    """Рейтинг на PLAYERS игроков: обновление очков, страницы /score, /rank."""
+    dp, bot = main.dp, main.bot
+    s = main.sessions[main.HOME]
+    from aiogram.types import User
+    for uid in range(100, 100 + PLAYERS):
+        main.remember_user(User(id=uid, is_bot=False, first_name=f"player{uid}"))
+        s.set_score(uid, rnd.randint(0, 500))
+
+    samples = []
+    for _ in range(n):
+        uid = rnd.randrange(100, 100 + PLAYERS)
+        t = perf_counter()
+        s.set_score(uid, s.scores[uid] + 1)
+        samples.append(perf_counter() - t)
+    report("leaderboard: set_score", samples)
+
+    pages = -(-PLAYERS // main.SCORE_PAGE_SIZE)
+    samples = []
+    for _ in range(max(1, n // 10)):
+        s.set_score(100, s.scores[100] + 1)   # каждый раз холодный кэш страниц
+        await timed(samples, main.render_score_page(s, rnd.randrange(pages)))
+    report("leaderboard: page (cold)", samples)
+
+    wanted = [rnd.randrange(pages) for _ in range(max(1, n // 10))]
+    for page in set(wanted):   # прогрев: меряем только повторные запросы уже отрисованных страниц
+        await main.render_score_page(s, page)
+    samples = []
+    for page in wanted:
+        await timed(samples, main.render_score_page(s, page))
+    report("leaderboard: page (cached)", samples)
+
+    updates = [make_message("/rank", uid=rnd.randrange(100, 100 + PLAYERS)) for _ in range(max(1, n // 10))]
+    samples = []
+    for u in updates:
+        await timed(samples, dp.feed_update(bot, u))
+    report("leaderboard: /rank", samples)
+
+    updates = [make_callback(f"score:{rnd.randrange(pages)}", uid=100) for _ in range(max(1, n // 10))]
+    samples = []
+    for u in updates:
+        await timed(samples, dp.feed_update(bot, u))
+    report("leaderboard: /score button", samples)
+
+async def bench_pick(main, n: int, rnd: random.Random):
+    """Выбор слова без повторов из словаря на WORDS слов."""
+    s = main.sessions[main.HOME]
+    samples = []
+    for _ in range(n):
+        t = perf_counter()
+        w = s.pick_new_word()
+        samples.append(perf_counter() - t)
+        if w is None:
+            s.used.clear()
+    report("pick_new_word", samples)
+
+async def bench_flush(main, n: int, rnd: random.Random):
+    """Write-behind: сброс очков после пачки изменений."""
+    s = main.sessions[main.HOME]
+    samples = []
+    for _ in range(max(1, n // 100)):
+        for _ in range(50):
+            uid = rnd.randrange(100, 100 + PLAYERS)
+            s.set_score(uid, s.scores.get(uid, 0) + 1)
+        main.mark_dirty("stats")
+        await timed(samples, main.flush_state())
+    report(f"flush_state ({main.STORAGE})", samples)
+
+async def bench_webhook(main, n: int, rnd: random.Random):
+    """Вебхук: aiohttp-приложение бота под TestClient, апдейты — как их шлёт Telegram."""
+    from aiohttp.test_utils import TestClient, TestServer
+    main.WEBHOOK_SECRET = "bench-secret"
+    client = TestClient(TestServer(main.make_webhook_app()))
+    await client.start_server()
+    try:
+        good = {"X-Telegram-Bot-Api-Secret-Token": main.WEBHOOK_SECRET}
+        bad = {"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+
+        def body(update) -> str:
+            return update.model_dump_json(by_alias=True, exclude_none=True)
+
+        probe = body(make_message("/top", uid=2))
+        for headers, want in (({}, 401), (bad, 401), (good, 200)):
+            resp = await client.post(main.WEBHOOK_PATH, data=probe, headers=headers)
+            assert resp.status == want, f"вебхук ответил {resp.status} вместо {want}"
+        resp = await client.get("/health")
+        assert resp.status == 200 and (await resp.json())["status"] == "ok"
+
+        await client.post(main.WEBHOOK_PATH, data=body(make_message("/startgame", uid=2)), headers=good)
+        words = main.dictionary.words
+        updates = [body(make_message(rnd.choice(words), uid=10 + i % 500)) for i in range(n)]
+
+        def handled() -> int:
+            return sum(row[-1] for row in main.handler_seconds.values.values())
+
+        before = handled()
+        samples = []
+        for data in updates:
+            t = perf_counter()
+            resp = await client.post(main.WEBHOOK_PATH, data=data, headers=good)
+            samples.append(perf_counter() - t)
+            assert resp.status == 200
+        report("webhook: POST update", samples)
+        for _ in range(500):   # апдейты обрабатываются в фоне уже после ответа 200
+            if handled() - before >= n:
+                break
+            await asyncio.sleep(0.01)
+        print(f"{'':<28} обработано апдейтов: {handled() - before} из {n}")
+    finally:
+        await client.close()
+
+BENCHES = {
+    "guess": bench_guess,
+    "leaderboard": bench_leaderboard,
+    "pick": bench_pick,
+    "flush": bench_flush,
+    "webhook": bench_webhook,
+}
+
+# =========================================================
+#                       ЗАПУСК
+# =========================================================
+def prepare_workdir(rnd: random.Random) -> str:
+    """Временная папка со словарём из WORDS синтетических слов."""
+    workdir = tempfile.mkdtemp(prefix="crocodile-bench-")
+    letters = "абвгдежзиклмнопрстуфхцчшщэюя"
+    words = set()
+    while len(words) < WORDS:
+        words.add("".join(rnd.choice(letters) for _ in range(rnd.randint(5, 12))))
+    with open(os.path.join(workdir, "words.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(sorted(words)) + "\n")
+    return workdir
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    os.chdir(prepare_workdir(rnd))
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    os.environ["CHAT_ID"] = str(CHAT)
+    os.environ["STORAGE"] = args.storage
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import logging
+    import main
+    logging.disable(logging.WARNING)
+
+    main.bot.session = make_fake_session()
+    main.bot.session.middleware(main.measure_api)
+    main.OUTBOX_GROUP_RATE = main.OUTBOX_GROUP_BURST = main.OUTBOX_GLOBAL_RATE = 1e9
+    main.load_state()
+    main.state_ready.set()
+    tasks = [asyncio.create_task(main.outbox.run()), asyncio.create_task(main.scheduler.run())]
+
+    print(f"словарь {len(main.dictionary)} слов, игроков {PLAYERS}, n={args.n}, seed={args.seed}, "
+          f"storage={args.storage}")
+    for name in args.benches or BENCHES:
+        await BENCHES[name](main, args.n, rnd)
+        await main.outbox.drain()
+
+    for t in tasks:
+        t.cancel()
+    if not args.keep:
+        shutil.rmtree(os.getcwd(), ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности бота без сети")
+    parser.add_argument("benches", nargs="*", help=f"какие замеры запускать: {', '.join(BENCHES)}")
+    parser.add_argument("-n", type=int, default=5000, help="операций на замер")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=["files", "sqlite"], default="files")
+    parser.add_argument("--keep", action="store_true", help="не удалять временную папку")
+    args = parser.parse_args()
+    unknown = [b for b in args.benches if b not in BENCHES]
+    if unknown:
+        parser.error(f"неизвестные замеры: {', '.join(unknown)}")
+    asyncio.run(run(args))
@@ -1,19 +1,37 @@
+import io
 import os
+import re
 import json
+import zlib
+import struct
 import logging
 import random
+import signal
 import asyncio
+import sqlite3
+import threading
+from array import array
+from collections import deque
+from bisect import bisect_left, insort
+from heapq import heappush, heappop
 from datetime import datetime, date, time, timedelta
+from time import monotonic
+from functools import partial
 
 from aiogram import Bot, Dispatcher
 from aiogram.filters import Command
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from aiogram.types import (
     Message,
     CallbackQuery,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     BotCommand,
+    ChatMemberUpdated,
 )
 
 # =========================================================
@@ -21,6 +39,7 @@ from aiogram.types import (
 # =========================================================
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+STARTED_AT = monotonic()  # для замера времени холодного старта
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHAT_ID = int(os.getenv("CHAT_ID", "0"))        # id группы
@@ -33,11 +52,65 @@ SUPER_OFFICER_USERNAME = "@yakovlef"  # единственный супер-оф
 SUPER_OFFICER_ID = None              # запомним id при первом обращении
 
 WORDS_FILE = "words.txt"
-USED_WORDS_FILE = "used_words.txt"
+USED_WORDS_FILE = "used_words.txt"        # журнал: по слову на строку
+USED_SNAPSHOT_FILE = "used_words.bin"     # снимок: битовая маска по словарю
 SCORES_FILE = "scores.json"
 STATS_FILE = "stats.json"
+META_FILE = "meta.json"    # служебные отметки (хэш меню команд)
+EVENTS_FILE = "events.jsonl"   # журнал событий игры
+WORD_STATS_FILE = "word_stats.json"  # сложность сыгранных слов
+
+STORAGE = os.getenv("STORAGE", "files")         # files | sqlite
+DB_FILE = os.getenv("DB_FILE", "crocodile.db")  # база для STORAGE=sqlite
+SESSIONS_DIR = "sessions"   # очки/слова сессий других чатов и тем (STORAGE=files)
+
+WORDS_RECHECK_SECONDS = 30  # как часто проверять, не правили ли words.txt руками
+WORD_MIN_LEN = 4            # длина нового слова (без ё/дефисов) для /addword и импорта
+WORD_MAX_LEN = 32
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # больше файл бот через Bot API не скачает
+USED_JOURNAL_MAX = 500      # после стольких строк журнал сворачивается в снимок
+FLUSH_INTERVAL = 5          # раз во сколько секунд сбрасывать очки/статистику на диск
+EVENTS_QUEUE_SIZE = 10_000  # событий в очереди журнала; сверх — теряем, а не тормозим игру
+EVENTS_FSYNC_INTERVAL = 5   # раз во сколько секунд fsync журнала
+EVENTS_MAX_BYTES = 10 * 1024 * 1024  # размер events.jsonl до ротации
+EVENTS_KEEP = 5             # сколько старых файлов журнала хранить
 
 INACTIVITY_HOURS = 3   # через сколько часов бездействия предложить сыграть
+ROUND_SECONDS = int(os.getenv("ROUND_SECONDS", "0"))  # лимит на слово; 0 — без лимита
+ROUND_HINTS = 2        # сколько подсказок-напоминаний до конца раунда
+ROSTER_SIZE = 50       # сколько последних игроков помнить для передачи хода
+
+MULTI_CHAT = os.getenv("MULTI_CHAT", "0") == "1"  # играть в любых группах/темах, не только CHAT_ID
+SESSION_IDLE_HOURS = 24  # через сколько часов простоя выгружать сессию чужого чата из памяти
+FUZZY_GUESS = os.getenv("FUZZY_GUESS", "0") == "1"  # засчитывать словоформы и опечатки в 1 букву
+ADAPTIVE_WORDS = os.getenv("ADAPTIVE_WORDS", "0") == "1"  # подбирать сложность слов под группу
+
+# сложность слова — сколько попыток на него обычно уходит
+WORD_PRIOR_ATTEMPTS = 10       # ожидание для несыгранного слова
+WORD_PRIOR_ROUNDS = 2          # вес этого ожидания в раундах
+WORD_FAIL_ATTEMPTS = 30        # столько «стоит» раунд, где слово заменили или бросили
+DIFFICULTY_BOUNDS = (3, 6, 12, 20, 30)   # границы уровней 0..5 по ожидаемым попыткам
+BAND_WEIGHTS = (16, 6, 2, 1)   # вес слова по удалённости его уровня от целевого
+DIFFICULTY_STEP = 0.25         # на сколько сдвигать целевой уровень сессии после раунда
+
+USER_NAME_TTL = 6 * 3600      # сколько секунд доверяем закэшированному имени игрока
+NAME_LOOKUP_CONCURRENCY = 8   # сколько get_chat_member держим в полёте одновременно
+SCORE_PAGE_SIZE = 25          # игроков на страницу /score
+ADMIN_CACHE_TTL = 600         # через сколько секунд перечитывать список админов
+
+OUTBOX_GROUP_RATE = 20 / 60   # сообщений в секунду на группу (лимит Telegram — 20 в минуту)
+OUTBOX_GROUP_BURST = 5        # сколько можно отправить подряд, если группа молчала
+OUTBOX_GLOBAL_RATE = 25       # сообщений в секунду на всего бота (лимит Telegram — 30)
+
+# вебхук вместо long polling: задан WEBHOOK_URL — поднимаем свой aiohttp-сервер
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")   # публичный адрес, напр. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")          # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))        # /metrics и /health; 0 — не поднимать
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")    # по умолчанию только локально
 
 bot = Bot(
     token=BOT_TOKEN,
@@ -45,102 +118,2256 @@ bot = Bot(
 )
 dp = Dispatcher()
 
+# =========================================================
+#                        МЕТРИКИ
+#  Счётчики и гистограммы в памяти, текст в формате
+#  Prometheus отдаёт GET /metrics на METRICS_HOST:METRICS_PORT.
+# =========================================================
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, n: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + n
+
+    def _labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{self._labels(k)} {v}" for k, v in self.values.items()]
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        # метки → [попадания по корзинам..., сумма, количество]; накопленные суммы — при выдаче
+        row = self.values.get(label_values)
+        if row is None:
+            row = self.values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = []
+        for k, row in self.values.items():
+            acc = 0
+            for le, n in zip(self.buckets, row):
+                acc += n
+                labels = self._labels(k, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {acc}")
+            labels = self._labels(k, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {row[-1]}")
+            lines.append(f"{self.name}_sum{self._labels(k)} {row[-2]}")
+            lines.append(f"{self.name}_count{self._labels(k)} {row[-1]}")
+        return lines
+
+class Gauge(Counter):
+    """Значение считается в момент запроса /metrics."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.fn()}"]
+
+handler_seconds = Histogram("crocodile_handler_seconds", "Время обработки апдейта хэндлером", ("handler",))
+handler_errors = Counter("crocodile_handler_errors_total", "Исключения в хэндлерах", ("handler",))
+api_seconds = Histogram("crocodile_telegram_request_seconds", "Запросы к Telegram Bot API", ("method",))
+api_errors = Counter("crocodile_telegram_errors_total", "Ошибки запросов к Telegram", ("method", "error"))
+flush_seconds = Histogram("crocodile_flush_seconds", "Сброс очков и статистики в хранилище")
+guesses = Counter("crocodile_guesses_total", "Попытки угадать слово", ("result",))
+events_dropped = Counter("crocodile_events_dropped_total", "События, не влезшие в очередь журнала")
+METRICS = [
+    handler_seconds, handler_errors, api_seconds, api_errors, flush_seconds, guesses, events_dropped,
+    Gauge("crocodile_active_rounds", "Идущие раунды", lambda: sum(s.active for s in sessions.values())),
+    Gauge("crocodile_sessions", "Сессии в памяти", lambda: len(sessions)),
+    Gauge("crocodile_outbox_queued", "Запросы в очереди на отправку",
+          lambda: sum(len(q) for lane in outbox.lanes.values() for q in lane.queues)),
+]
+
+def render_metrics() -> str:
+    lines = []
+    for m in METRICS:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+@dp.message.middleware()
+@dp.callback_query.middleware()
+async def measure_handler(handler, event, data):
+    # внутренний middleware: фильтры уже прошли, хэндлер известен
+    name = data["handler"].callback.__name__
+    started = monotonic()
+    try:
+        return await handler(event, data)
+    except Exception:
+        handler_errors.inc(name)
+        raise
+    finally:
+        handler_seconds.observe(monotonic() - started, name)
+
+async def measure_api(make_request, bot, method):
+    name = type(method).__name__
+    started = monotonic()
+    try:
+        return await make_request(bot, method)
+    except Exception as e:
+        api_errors.inc(name, type(e).__name__)
+        raise
+    finally:
+        api_seconds.observe(monotonic() - started, name)
+
+bot.session.middleware(measure_api)
+
 # =========================================================
 #                    ХРАНИЛИЩА / ФАЙЛЫ
 # =========================================================
+class CorruptFile(ValueError):
+    """Файл состояния не читается. Он отложен в сторону, данные берём из журнала событий."""
+
+def quarantine(path: str, reason) -> CorruptFile:
+    """Убрать битый файл с дороги (его не перезапишут) и вернуть ошибку для raise."""
+    aside = f"{path}.corrupt-{datetime.now():%Y%m%d-%H%M%S}"
+    try:
+        os.replace(path, aside)
+    except OSError:
+        aside = path
+    logger.error(f"{path} не читается ({reason}), отложен как {aside}")
+    return CorruptFile(path)
+
 def load_json(path: str, default):
+    """Нет файла (или он пустой) — default. Битый файл — CorruptFile, а не тихая подмена данных."""
     try:
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
+            text = f.read()
+        return json.loads(text) if text.strip() else default
+    except FileNotFoundError:
         return default
+    except ValueError as e:   # JSONDecodeError, UnicodeDecodeError
+        raise quarantine(path, e) from e
+
+def atomic_write(path: str, data: bytes):
+    """Запись через временный файл + os.replace: файл либо старый, либо новый целиком."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
 def save_json(path: str, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    atomic_write(path, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))
 
-def load_scores() -> dict[int, int]:
-    raw = load_json(SCORES_FILE, {})
+def load_scores(path: str = SCORES_FILE) -> dict[int, int]:
+    raw = load_json(path, {})
     try:
         return {int(k): int(v) for k, v in raw.items()}
-    except:
-        return {}
+    except (AttributeError, TypeError, ValueError) as e:
+        raise quarantine(path, e) from e
 
-def save_scores(scores: dict[int, int]):
-    save_json(SCORES_FILE, {str(k): v for k, v in scores.items()})
+def save_scores(scores: dict[int, int], path: str = SCORES_FILE):
+    save_json(path, {str(k): v for k, v in scores.items()})
 
-def load_used_words() -> set[str]:
+def load_used_words(path: str = USED_WORDS_FILE) -> list[str]:
+    """Слова из журнала used_words.txt (то, что ещё не свёрнуто в снимок). Битый файл — CorruptFile."""
     try:
-        with open(USED_WORDS_FILE, "r", encoding="utf-8") as f:
-            return {w.strip().lower() for w in f if w.strip()}
-    except:
-        return set()
-
-def save_used_word(word: str):
-    with open(USED_WORDS_FILE, "a", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
+            return [w.strip().lower() for w in f if w.strip()]
+    except FileNotFoundError:
+        return []
+    except UnicodeDecodeError as e:
+        raise quarantine(path, e) from e
+
+def save_used_word(word: str, path: str = USED_WORDS_FILE):
+    with open(path, "a", encoding="utf-8") as f:
         f.write(word.lower() + "\n")
 
-def load_words_list() -> list[str]:
-    try:
-        with open(WORDS_FILE, "r", encoding="utf-8") as f:
-            words = [w.strip().lower() for w in f if w.strip()]
-        if not words:
-            raise ValueError("Пустой words.txt")
-        return words
-    except:
-        return ["яблоко", "кошка", "самолет", "дерево", "лампа"]
+FALLBACK_WORDS = ["яблоко", "кошка", "самолет", "дерево", "лампа"]  # только для старта без словаря
 
-def load_stats():
-    stats = load_json(STATS_FILE, {
-        "total_guessed": 0,
-        "today_guessed": 0,
-        "today_date": str(date.today())
-    })
+def load_words_list(path: str = WORDS_FILE) -> list[str]:
+    """Слова из words.txt; пустой список, если файла нет, он пустой или не читается."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [w.strip().lower() for w in f if w.strip()]
+    except FileNotFoundError:
+        return []
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning(f"{path} не читается: {e}")
+        return []
+
+def fresh_stats(stats: dict) -> dict:
     # если день сменился — обнуляем today
     if stats.get("today_date") != str(date.today()):
         stats["today_date"] = str(date.today())
         stats["today_guessed"] = 0
     return stats
 
+def load_stats():
+    return fresh_stats(load_json(STATS_FILE, {
+        "total_guessed": 0,
+        "today_guessed": 0,
+        "today_date": str(date.today())
+    }))
+
 def save_stats(stats):
     save_json(STATS_FILE, stats)
 
-scores: dict[int, int] = load_scores()
-used_words: set[str] = load_used_words()
-stats = load_stats()
+# =========================================================
+#                  БЭКЕНДЫ ХРАНЕНИЯ
+#  Общий интерфейс над load_*/save_*:
+#  - load_words / add_word / add_words / words_signature — словарь;
+#  - load_used / append_used / rewrite_used — использованные слова;
+#  - load_scores / scores_writer, load_stats / stats_writer — очки и
+#    статистика; *_writer возвращают функцию записи, которую
+#    write-behind выполняет в отдельном потоке;
+#  - load_word_stats / word_stats_writer — сложность слов (общая);
+#  - get_meta / set_meta — служебные строки.
+# =========================================================
+class FileStorage:
+    """
+    Файлы рядом с ботом: words.txt, scores.json, stats.json и
+    used_words.bin + used_words.txt. У сессий других чатов/тем (scope)
+    свои scores.json и used_words.* в SESSIONS_DIR/<scope>/,
+    словарь и статистика — общие.
+
+    Использованные слова: used_words.bin — снимок битовой маски
+    (заголовок: число слов + crc32 словаря), used_words.txt — журнал,
+    куда дописывается каждое новое слово. Когда журнал дорастает до
+    USED_JOURNAL_MAX строк, маска атомарно пишется в снимок, а журнал
+    обнуляется. Повторное применение журнала поверх снимка безопасно,
+    так что падение между шагами ничего не теряет.
+
+    После маски в снимке лежат строками слова вне словаря (spill) и
+    сами загаданные слова. Пока crc сходится, читаются только маска и
+    spill; если words.txt правили, пока бот стоял, снимок разбирается
+    по строкам — история не теряется.
+    """
+
+    name = "files"
+    MAGIC = b"CRUW2"
+    HEADER = struct.Struct("<5sIIII")  # magic, число слов, crc32 словаря, байт spill, байт слов
+    MAGIC_V1 = b"CRUW1"
+    HEADER_V1 = struct.Struct("<5sII")  # старый снимок: только маска
+
+    def __init__(self, scope: str = ""):
+        self.scope = scope
+        self.journal_lines = 0
+        if scope:
+            # папку создаём при первой записи: чат, где только заглянули в /score, следа не оставляет
+            base = os.path.join(SESSIONS_DIR, scope)
+            self.scores_file = os.path.join(base, SCORES_FILE)
+            self.used_file = os.path.join(base, USED_WORDS_FILE)
+            self.snapshot_file = os.path.join(base, USED_SNAPSHOT_FILE)
+        else:
+            self.scores_file = SCORES_FILE
+            self.used_file = USED_WORDS_FILE
+            self.snapshot_file = USED_SNAPSHOT_FILE
+
+    def for_scope(self, scope: str) -> "FileStorage":
+        return FileStorage(scope)
+
+    def _makedirs(self):
+        if self.scope:
+            os.makedirs(os.path.dirname(self.scores_file), exist_ok=True)
+
+    # ---------- словарь ----------
+    def load_words(self) -> list[str]:
+        return load_words_list(WORDS_FILE)
+
+    def words_signature(self):
+        try:
+            st = os.stat(WORDS_FILE)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def add_word(self, word: str):
+        with open(WORDS_FILE, "a", encoding="utf-8") as f:
+            f.write(word + "\n")
+
+    def add_words(self, words: list[str]):
+        """Пачка слов одной атомарной перезаписью: старые строки + новые в конце (индексы не сдвигаются)."""
+        try:
+            with open(WORDS_FILE, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data and not data.endswith(b"\n"):
+            data += b"\n"
+        atomic_write(WORDS_FILE, data + "".join(w + "\n" for w in words).encode("utf-8"))
+
+    # ---------- использованные слова ----------
+    @staticmethod
+    def fingerprint(words: list[str], n: int) -> int:
+        crc = 0
+        for w in words[:n]:
+            crc = zlib.crc32(w.encode("utf-8") + b"\n", crc)
+        return crc
+
+    def load_used(self, used: "UsedWords"):
+        try:
+            with open(self.snapshot_file, "rb") as f:
+                raw = f.read()
+            if raw[:5] == self.MAGIC:
+                _, n, crc, spill_len, words_len = self.HEADER.unpack_from(raw)
+                start = self.HEADER.size
+            elif raw[:5] == self.MAGIC_V1:
+                _, n, crc = self.HEADER_V1.unpack_from(raw)
+                spill_len = words_len = 0
+                start = self.HEADER_V1.size
+            else:
+                raise ValueError("неизвестный формат")
+            spill_at = start + (n + 7) // 8
+            words_at = spill_at + spill_len
+            if len(raw) < words_at + words_len:
+                raise ValueError("снимок обрезан")
+            spill = raw[spill_at:words_at].decode("utf-8").split("\n")
+            if n <= len(used.words) and crc == self.fingerprint(used.words, n):
+                # маску — первой: копия байтов затёрла бы биты spill-слов, вернувшихся в словарь
+                body = raw[start:spill_at]
+                used.bits[:len(body)] = body
+            elif words_len:
+                # словарь правили, пока бот стоял: индексы не годятся, берём слова строками
+                logger.warning("used_words.bin от другого словаря — загаданные слова берутся по строкам")
+                for w in raw[words_at:words_at + words_len].decode("utf-8").split("\n"):
+                    if w:
+                        used.mark(w)
+            else:
+                raise ValueError("не совпадает со словарём")
+            for w in spill:
+                if w:
+                    used.mark(w)
+        except FileNotFoundError:
+            pass
+        except (struct.error, ValueError) as e:   # UnicodeDecodeError — тоже ValueError
+            # снимок не годится — загаданные слова берём из журнала событий
+            logger.warning(f"used_words.bin пропущен ({e}), слова восстанавливаются из журнала")
+            for w in replay_used(scope_key(self.scope)):
+                used.mark(w)
+
+        try:
+            journal = load_used_words(self.used_file)
+        except CorruptFile:
+            # журнал отложен в сторону — его слова есть в журнале событий; сразу пишем свежий снимок
+            for w in replay_used(scope_key(self.scope)):
+                used.mark(w)
+            self.rewrite_used(used)
+            return
+        for w in journal:
+            used.mark(w)
+        self.journal_lines = len(journal)
+        if self.journal_lines >= USED_JOURNAL_MAX:
+            self.rewrite_used(used)
+
+    def append_used(self, used: "UsedWords", word: str):
+        self._makedirs()
+        save_used_word(word, self.used_file)
+        self.journal_lines += 1
+        if self.journal_lines >= USED_JOURNAL_MAX:
+            self.rewrite_used(used)
+
+    def rewrite_used(self, used: "UsedWords"):
+        """Снимок маски (плюс spill и слова строками) на диск, затем обнуление журнала."""
+        n = len(used.words)
+        spill = "".join(w + "\n" for w in used.spill).encode("utf-8")
+        words = "".join(w + "\n" for w in used.marked()).encode("utf-8")
+        header = self.HEADER.pack(self.MAGIC, n, self.fingerprint(used.words, n), len(spill), len(words))
+        self._makedirs()
+        atomic_write(self.snapshot_file, header + bytes(used.bits[:(n + 7) // 8]) + spill + words)
+        with open(self.used_file, "w", encoding="utf-8"):
+            pass
+        self.journal_lines = 0
+
+    # ---------- очки и статистика ----------
+    def load_scores(self) -> dict[int, int]:
+        return load_scores(self.scores_file)
+
+    def scores_writer(self, scores: dict[int, int], changed: set[int]):
+        return partial(self._save_scores, dict(scores))
+
+    def _save_scores(self, scores: dict[int, int]):
+        self._makedirs()
+        save_scores(scores, self.scores_file)
+
+    def load_stats(self) -> dict:
+        return load_stats()
+
+    def stats_writer(self, stats: dict):
+        return partial(save_stats, dict(stats))
+
+    # ---------- сложность слов ----------
+    def load_word_stats(self) -> dict[str, list[int]]:
+        return load_json(WORD_STATS_FILE, {})
+
+    def word_stats_writer(self, table: "WordStats", changed: set[int]):
+        return partial(save_json, WORD_STATS_FILE, table.played())
+
+    # ---------- служебное ----------
+    def get_meta(self, key: str) -> str | None:
+        return load_json(META_FILE, {}).get(key)
+
+    def set_meta(self, key: str, value: str):
+        meta = load_json(META_FILE, {})
+        meta[key] = value
+        save_json(META_FILE, meta)
+
+class SqliteStorage:
+    """
+    Всё состояние в одной SQLite-базе (WAL): обновление очков — запись
+    одной строки, а не перезапись файла. Соединение общее, запросы
+    сериализуются локом: write-behind ходит в базу из потока.
+    При первом открытии пустой базы в неё переносятся текущие файлы.
+    Очки и использованные слова разделены по scope (сессии чатов/тем),
+    for_scope() отдаёт представление над тем же соединением.
+    """
+
+    name = "sqlite"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS words (
+            id   INTEGER PRIMARY KEY,
+            word TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS used_words (
+            scope   TEXT NOT NULL DEFAULT '',
+            word_id INTEGER NOT NULL REFERENCES words(id),
+            used_at TEXT NOT NULL,
+            PRIMARY KEY (scope, word_id)
+        );
+        CREATE TABLE IF NOT EXISTS scores (
+            scope   TEXT NOT NULL DEFAULT '',
+            user_id INTEGER NOT NULL,
+            points  INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (scope, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS scores_points ON scores(scope, points DESC);
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS word_stats (
+            word_id  INTEGER PRIMARY KEY REFERENCES words(id),
+            rounds   INTEGER NOT NULL,
+            guessed  INTEGER NOT NULL,
+            replaced INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            seconds  INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, scope: str = "", parent: "SqliteStorage | None" = None):
+        self.path = path
+        self.scope = scope
+        if parent is not None:
+            self._lock = parent._lock
+            self._conn = parent._conn
+            return
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._upgrade()
+        self._conn.executescript(self.SCHEMA)
+        if self.get_meta("migrated_at") is None:
+            migrate_files_to_sqlite(self)
+
+    def _upgrade(self):
+        """Схема без scope (один чат) → таблицы с scope; старые данные — в scope ''."""
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(scores)")}
+        if cols and "scope" not in cols:
+            self._conn.executescript(
+                "BEGIN;"
+                "ALTER TABLE scores RENAME TO scores_v0;"
+                "ALTER TABLE used_words RENAME TO used_words_v0;"
+                "DROP INDEX IF EXISTS scores_points;"
+                + self.SCHEMA +
+                "INSERT INTO scores(user_id, points, updated_at) "
+                "SELECT user_id, points, updated_at FROM scores_v0;"
+                "INSERT INTO used_words(word_id, used_at) "
+                "SELECT word_id, used_at FROM used_words_v0;"
+                "DROP TABLE scores_v0;"
+                "DROP TABLE used_words_v0;"
+                "COMMIT;"
+            )
+        self._conn.execute("PRAGMA user_version = 1")
+
+    def for_scope(self, scope: str) -> "SqliteStorage":
+        return SqliteStorage(self.path, scope, parent=self)
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _transaction(self, statements: list[tuple[str, list]]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sql, rows in statements:
+                    self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, key: str) -> str | None:
+        rows = self._execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str):
+        self._execute(
+            "INSERT INTO meta(key, value) VALUES(?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    # ---------- словарь ----------
+    def load_words(self) -> list[str]:
+        words = [r[0] for r in self._execute("SELECT word FROM words ORDER BY id")]
+        return words or load_words_list()
+
+    def words_signature(self):
+        # data_version меняется, только если базу правил кто-то другой
+        return self._execute("PRAGMA data_version")[0][0]
+
+    def add_word(self, word: str):
+        self._execute("INSERT OR IGNORE INTO words(word) VALUES(?)", (word,))
+
+    def add_words(self, words: list[str]):
+        self._transaction([("INSERT OR IGNORE INTO words(word) VALUES(?)", [(w,) for w in words])])
+
+    # ---------- использованные слова ----------
+    def load_used(self, used: "UsedWords"):
+        for (w,) in self._execute(
+            "SELECT w.word FROM used_words u JOIN words w ON w.id = u.word_id "
+            "WHERE u.scope = ?", (self.scope,)
+        ):
+            used.mark(w)
+
+    def append_used(self, used: "UsedWords", word: str):
+        self._execute(
+            "INSERT OR IGNORE INTO used_words(scope, word_id, used_at) "
+            "SELECT ?, id, ? FROM words WHERE word = ?",
+            (self.scope, datetime.now().isoformat(timespec="seconds"), word),
+        )
+
+    def rewrite_used(self, used: "UsedWords"):
+        """
+        Привести строки scope к used разницей: дописать недостающие, удалить
+        лишние. Уже записанные строки не трогаются — used_at у них прежний.
+        """
+        # слова вне словаря (spill) тоже держим: строка останется, если слово ещё есть в words
+        keep = set(used.marked())
+        keep.update(used.spill)
+        if not keep:
+            self._transaction([("DELETE FROM used_words WHERE scope = ?", [(self.scope,)])])
+            return
+        stored = self._execute(
+            "SELECT u.word_id, w.word FROM used_words u JOIN words w ON w.id = u.word_id "
+            "WHERE u.scope = ?", (self.scope,)
+        )
+        now = datetime.now().isoformat(timespec="seconds")
+        stale = [(self.scope, wid) for wid, w in stored if w not in keep]
+        keep.difference_update(w for _, w in stored)
+        self._transaction([
+            ("DELETE FROM used_words WHERE scope = ? AND word_id = ?", stale),
+            ("INSERT OR IGNORE INTO used_words(scope, word_id, used_at) "
+             "SELECT ?, id, ? FROM words WHERE word = ?", [(self.scope, now, w) for w in keep]),
+        ])
+
+    # ---------- очки и статистика ----------
+    def load_scores(self) -> dict[int, int]:
+        return {
+            uid: pts for uid, pts in
+            self._execute("SELECT user_id, points FROM scores WHERE scope = ?", (self.scope,))
+        }
+
+    def _write_scores(self, rows: list[tuple[int, int | None]]):
+        now = datetime.now().isoformat(timespec="seconds")
+        self._transaction([
+            ("INSERT INTO scores(scope, user_id, points, updated_at) VALUES(?, ?, ?, ?) "
+             "ON CONFLICT(scope, user_id) DO UPDATE SET points = excluded.points, "
+             "updated_at = excluded.updated_at",
+             [(self.scope, uid, pts, now) for uid, pts in rows if pts is not None]),
+            ("DELETE FROM scores WHERE scope = ? AND user_id = ?",
+             [(self.scope, uid) for uid, pts in rows if pts is None]),
+        ])
+
+    def scores_writer(self, scores: dict[int, int], changed: set[int]):
+        return partial(self._write_scores, [(uid, scores.get(uid)) for uid in changed])
+
+    def load_stats(self) -> dict:
+        raw = self.get_meta("stats")
+        try:
+            stats = json.loads(raw) if raw else None
+        except ValueError as e:
+            logger.error(f"meta.stats в {self.path} не читается ({e})")
+            raise CorruptFile("meta:stats") from e
+        stats = stats or {
+            "total_guessed": 0,
+            "today_guessed": 0,
+            "today_date": str(date.today())
+        }
+        return fresh_stats(stats)
+
+    def stats_writer(self, stats: dict):
+        return partial(self.set_meta, "stats", json.dumps(stats, ensure_ascii=False))
+
+    # ---------- сложность слов ----------
+    def load_word_stats(self) -> dict[str, list[int]]:
+        return {
+            w: list(row) for w, *row in self._execute(
+                "SELECT w.word, s.rounds, s.guessed, s.replaced, s.attempts, s.seconds "
+                "FROM word_stats s JOIN words w ON w.id = s.word_id"
+            )
+        }
+
+    def word_stats_writer(self, table: "WordStats", changed: set[int]):
+        rows = [(*table.row(i), table.words[i]) for i in changed if i < len(table.words)]
+        return partial(self._transaction, [(
+            "INSERT INTO word_stats(word_id, rounds, guessed, replaced, attempts, seconds) "
+            "SELECT id, ?, ?, ?, ?, ? FROM words WHERE word = ? "
+            "ON CONFLICT(word_id) DO UPDATE SET rounds = excluded.rounds, "
+            "guessed = excluded.guessed, replaced = excluded.replaced, "
+            "attempts = excluded.attempts, seconds = excluded.seconds",
+            rows,
+        )])
+
+def migrate_files_to_sqlite(db: SqliteStorage):
+    """Разовый перенос words.txt / used_words.* / scores.json / stats.json в базу."""
+    files = FileStorage()
+    old_dict = WordDictionary(files)
+    old_dict.refresh(force=True)
+    now = datetime.now().isoformat(timespec="seconds")
+    scopes = [""]
+    if os.path.isdir(SESSIONS_DIR):
+        scopes += sorted(os.listdir(SESSIONS_DIR))
+
+    statements = [("INSERT OR IGNORE INTO words(word) VALUES(?)", [(w,) for w in old_dict.words])]
+    players = 0
+    for scope in scopes:
+        scoped = files.for_scope(scope)
+        old_used = UsedWords(old_dict, scoped)
+        old_used.load()
+        try:
+            old_scores = scoped.load_scores()
+        except CorruptFile:
+            old_scores = replay_scores(scope_key(scope))
+        players += len(old_scores)
+        statements += [
+            ("INSERT OR IGNORE INTO used_words(scope, word_id, used_at) "
+             "SELECT ?, id, ? FROM words WHERE word = ?",
+             [(scope, now, w) for i, w in enumerate(old_dict.words) if old_used.has(i)]),
+            ("INSERT OR REPLACE INTO scores(scope, user_id, points, updated_at) VALUES(?, ?, ?, ?)",
+             [(scope, uid, pts, now) for uid, pts in old_scores.items()]),
+        ]
+    statements.append(
+        ("INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)",
+         [("stats", json.dumps(load_stats_or_replay(files), ensure_ascii=False)),
+          ("migrated_at", now)])
+    )
+    db._transaction(statements)
+    logger.info(f"Файлы перенесены в {db.path}: слов {len(old_dict)}, игроков {players}, сессий {len(scopes)}")
+
+def make_storage():
+    if STORAGE == "sqlite":
+        return SqliteStorage(DB_FILE)
+    return FileStorage()
 
 # =========================================================
-#                      СОСТОЯНИЕ ИГРЫ
+#                  СЛОВАРЬ И ИСПОЛЬЗОВАННЫЕ СЛОВА
 # =========================================================
-game = {
-    "active": False,
-    "word": None,
-    "leader_id": None,
-    "attempts": 0,
-    "special": False,         # спец-раунд?
-    "special_reward": 10,     # награда за спец-слово
-}
+class WordDictionary:
+    """
+    Словарь слов в памяти:
+    - читается из хранилища один раз;
+    - внешние правки (mtime/size words.txt, data_version базы) подхватываются
+      при проверке не чаще раза в WORDS_RECHECK_SECONDS;
+    - /addword и /importwords дописывают слова и в хранилище, и в память;
+    - keys — индекс по нормализованной форме (ё→е, без дефисов): по нему
+      отсеиваются дубли вроде «ёж»/«еж».
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.words: list[str] = []
+        self.index: dict[str, int] = {}
+        self.keys: dict[str, int] = {}   # normalize(слово) → индекс первого такого слова
+        self.generation = 0  # растёт при каждой перезагрузке — сессии по нему перекладывают маски used
+        self._sig = None
+        self._checked_at = 0.0
+        self.lock = asyncio.Lock()   # пакетная запись в потоке и /addword не пишут одновременно
+        self.writing = False         # идёт своя запись: файл меняется, но это не внешняя правка
+
+    def _load(self) -> bool:
+        """Перечитать слова из хранилища. Пустой/нечитаемый список не заменяет уже загруженный."""
+        loaded = self.storage.load_words()
+        if not loaded:
+            if self.words:
+                logger.warning("Словарь пуст или не читается — остаёмся на загруженном ранее")
+                return False
+            logger.warning("Словарь пуст или не читается — играем запасными словами")
+            loaded = FALLBACK_WORDS
+        self.generation += 1
+        self.words = []
+        self.index = {}
+        self.keys = {}
+        for w in loaded:
+            if w not in self.index:
+                self.index[w] = len(self.words)
+                self.keys.setdefault(normalize(w), len(self.words))
+                self.words.append(w)
+        return True
+
+    def refresh(self, force: bool = False) -> bool:
+        """Перечитать словарь, если его поменяли снаружи. True — словарь перезагружен."""
+        now = monotonic()
+        if self.writing or not force and self.words and now - self._checked_at < WORDS_RECHECK_SECONDS:
+            return False
+        self._checked_at = now
+        sig = self.storage.words_signature()
+        if self.words and sig == self._sig:
+            return False
+        if not self._load():
+            return False   # _sig не трогаем: через WORDS_RECHECK_SECONDS попробуем снова
+        self._sig = sig
+        return True
+
+    def find(self, word: str) -> str | None:
+        """Слово словаря с той же нормализованной формой или None."""
+        i = self.keys.get(normalize(word))
+        return None if i is None else self.words[i]
+
+    def _append(self, word: str, key: str | None = None):
+        self.index[word] = len(self.words)
+        self.keys.setdefault(key or normalize(word), len(self.words))
+        self.words.append(word)
+
+    def add(self, word: str) -> bool:
+        """Добавить слово в хранилище и в память. False — если такое слово (с точностью до ё) уже есть."""
+        # сверка без троттлинга: после записи _sig станет нашим, и правка,
+        # сделанная снаружи перед ней, иначе так и не перечиталась бы
+        self.refresh(force=True)
+        if self.find(word) is not None:
+            return False
+        self.storage.add_word(word)
+        self._append(word)
+        # своё изменение не считаем внешним
+        self._sig = self.storage.words_signature()
+        return True
+
+    def _store_batch(self, words: list[str]) -> list[tuple[str, str]]:
+        """Отсеять слова, которые (с точностью до ё) уже есть, и записать остальные в хранилище."""
+        new, seen = [], set()
+        for w in words:
+            key = normalize(w)
+            if key not in self.keys and key not in seen:
+                seen.add(key)
+                new.append((w, key))
+        if new:
+            self.storage.add_words([w for w, _ in new])
+        return new
+
+    def add_many(self, words: list[str]) -> list[str]:
+        """Добавить пачку одной записью хранилища (синхронно — для wordlist.py)."""
+        self.refresh(force=True)
+        new = self._store_batch(words)
+        for w, key in new:
+            self._append(w, key)
+        self._sig = self.storage.words_signature()
+        return [w for w, _ in new]
+
+    async def add_many_async(self, words: list[str]) -> list[str]:
+        """
+        Как add_many, но отсев и запись — в потоке, а в память слова вливаются
+        частями, отдавая управление event loop. Под lock: /addword ждёт, а
+        refresh() не принимает свою же запись за внешнюю правку.
+        """
+        async with self.lock:
+            self.refresh(force=True)
+            self.writing = True
+            try:
+                new = await asyncio.to_thread(self._store_batch, words)
+                for start in range(0, len(new), 5000):
+                    for w, key in new[start:start + 5000]:
+                        self._append(w, key)
+                    await asyncio.sleep(0)
+            finally:
+                self.writing = False
+            self._sig = self.storage.words_signature()
+            return [w for w, _ in new]
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.index
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+# ---------- импорт списков слов ----------
+# Конвейер генераторов: строки → слова → проверка → отсев дублей по
+# keys словаря. Файл читается потоком, в памяти только новые слова.
+_WORD_ALPHABET = re.compile(r"[а-яё]+(?:-[а-яё]+)*")
+_WORD_SEPARATORS = re.compile(r"[\s,;]+")
+IMPORT_COUNTERS = ("read", "alphabet", "length", "duplicate")
+
+def check_word(word: str) -> str | None:
+    """Почему слово не годится в словарь ("alphabet" / "length") или None."""
+    if not _WORD_ALPHABET.fullmatch(word):
+        return "alphabet"
+    if not WORD_MIN_LEN <= len(normalize(word)) <= WORD_MAX_LEN:
+        return "length"
+    return None
+
+def split_words(lines):
+    """Слова из строк списка: по одному или через пробел/запятую, регистр не важен."""
+    for line in lines:
+        for w in _WORD_SEPARATORS.split(line.lower().lstrip("\ufeff")):
+            if w:
+                yield w
+
+def import_words(lines, dictionary: WordDictionary, counts: dict[str, int]):
+    """Новые годные слова из lines; отказы и дубли считаются в counts (ключи IMPORT_COUNTERS)."""
+    seen: set[str] = set()
+    for w in split_words(lines):
+        counts["read"] += 1
+        reason = check_word(w)
+        if reason:
+            counts[reason] += 1
+            continue
+        key = normalize(w)
+        if key in dictionary.keys or key in seen:
+            counts["duplicate"] += 1
+            continue
+        seen.add(key)
+        yield w
+
+def import_report(counts: dict[str, int], added: int) -> str:
+    return (
+        f"прочитано {counts['read']}, добавлено {added}, дублей {counts['duplicate']}, "
+        f"не те буквы {counts['alphabet']}, не та длина {counts['length']}"
+    )
+
+RANDOM_TRIES = 32   # случайных проб по маске, прежде чем выбирать точно среди свободных
+
+def index_mask(indices) -> int:
+    """Набор индексов слов битовым числом: бит i — слово i."""
+    bits = bytearray((max(indices, default=-1) >> 3) + 1)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+class UsedWords:
+    """
+    Использованные слова — битовая маска по индексам словаря (1 бит на слово).
+    Она же и пул: новое слово — случайный индекс, чей бит не стоит, так что
+    у сессии кроме маски ничего нет.
+    Загаданные слова, которых в текущем словаре нет (его урезали или правят),
+    лежат строками в spill и возвращаются в маску, когда слово снова появится.
+    Как это лежит на диске, решает бэкенд хранения (load/append/rewrite_used).
+    """
+
+    __slots__ = ("dictionary", "storage", "words", "bits", "spill")
+
+    def __init__(self, dictionary: WordDictionary, storage):
+        self.dictionary = dictionary
+        self.storage = storage
+        self.words = dictionary.words  # список, к которому привязана маска
+        self.bits = bytearray((len(self.words) + 7) // 8)
+        self.spill: set[str] = set()
+
+    def _grow(self):
+        need = (len(self.dictionary.words) + 7) // 8
+        if len(self.bits) < need:
+            self.bits.extend(bytes(need - len(self.bits)))
+
+    def has(self, idx: int) -> bool:
+        return idx >> 3 < len(self.bits) and bool(self.bits[idx >> 3] & (1 << (idx & 7)))
+
+    def mark(self, word: str) -> bool:
+        """Поставить бит без записи на диск. True — если слово было свободно."""
+        idx = self.dictionary.index.get(word)
+        if idx is None:
+            if word in self.spill:
+                return False
+            self.spill.add(word)
+            return True
+        if self.has(idx):
+            return False
+        self._grow()
+        self.bits[idx >> 3] |= 1 << (idx & 7)
+        return True
+
+    def random_free(self, candidates: array | None = None, mask: int | None = None) -> int | None:
+        """
+        Случайное неиспользованное слово (из candidates или всего словаря),
+        равновероятно среди свободных. Пока свободных много, хватает пары
+        проб; когда почти всё загадано — nth_free по маске (mask — те же
+        candidates битовым числом, если у вызывающего она уже есть).
+        """
+        n = len(self.words) if candidates is None else len(candidates)
+        if not n:
+            return None
+        for _ in range(RANDOM_TRIES):
+            r = random.randrange(n)
+            i = r if candidates is None else candidates[r]
+            if not self.has(i):
+                return i
+        if candidates is not None and mask is None:
+            mask = index_mask(candidates)
+        return self.nth_free(mask)
+
+    def nth_free(self, mask: int | None = None) -> int | None:
+        """
+        Равновероятно одно из свободных слов среди mask (битовое число; None — весь словарь).
+        Маска и used — целые числа, так что подсчёт битов идёт в C: бинарный поиск
+        позиции r-го свободного — log n проходов по ~n/8 байтам.
+        """
+        n = len(self.words)
+        free = ((1 << n) - 1 if mask is None else mask) & ~int.from_bytes(self.bits, "little")
+        count = free.bit_count()
+        if not count:
+            return None
+        r = random.randrange(count)
+        lo, hi = 0, n - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (free & ((2 << mid) - 1)).bit_count() > r:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def marked(self):
+        """Слова, отмеченные в маске (без spill)."""
+        n = len(self.words)
+        for pos, byte in enumerate(self.bits):
+            while byte:
+                low = byte & -byte
+                i = (pos << 3) + low.bit_length() - 1
+                if i < n:
+                    yield self.words[i]
+                byte ^= low
+
+    def __contains__(self, word: str) -> bool:
+        idx = self.dictionary.index.get(word)
+        return word in self.spill if idx is None else self.has(idx)
+
+    def __len__(self) -> int:
+        return sum(bin(b).count("1") for b in self.bits) + len(self.spill)
+
+    def load(self):
+        self.words = self.dictionary.words
+        self.bits = bytearray((len(self.words) + 7) // 8)
+        self.spill = set()
+        self.storage.load_used(self)
+
+    def rebind(self):
+        """Словарь перечитан — перекладываем маску на новые индексы, пропавшие слова — в spill."""
+        used = list(self.marked())
+        used.extend(self.spill)
+        self.words = self.dictionary.words
+        self.bits = bytearray((len(self.words) + 7) // 8)
+        self.spill = set()
+        for w in used:
+            self.mark(w)
+        self.storage.rewrite_used(self)
+
+    def add(self, word: str):
+        if self.mark(word):
+            self.storage.append_used(self, word)
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.spill = set()
+        self.storage.rewrite_used(self)
+
+class WordStats:
+    """
+    Сложность слов — счётчики по индексам словаря в array('I'):
+    раунды, угадано, заменено, сумма попыток и секунд до ответа.
+    Общая на все сессии, как и словарь; при его перезагрузке
+    переезжает на новые индексы по самим словам.
+    """
+
+    COLUMNS = ("rounds", "guessed", "replaced", "attempts", "seconds")
+    __slots__ = ("dictionary", "storage", "words") + COLUMNS
+
+    def __init__(self, dictionary: WordDictionary, storage):
+        self.dictionary = dictionary
+        self.storage = storage
+        self.words: list[str] = []
+        for col in self.COLUMNS:
+            setattr(self, col, array("I"))
+
+    def _resize(self, rows: dict[str, list[int]]):
+        self.words = self.dictionary.words
+        n = len(self.words)
+        for col in self.COLUMNS:
+            setattr(self, col, array("I", bytes(4 * n)))
+        for w, row in rows.items():
+            i = self.dictionary.index.get(w)
+            if i is not None:
+                for col, v in zip(self.COLUMNS, row):
+                    getattr(self, col)[i] = v
+
+    def load(self):
+        try:
+            self._resize(self.storage.load_word_stats())
+        except CorruptFile:
+            self._resize({})   # это статистика, не очки: начинаем заново
+
+    def sync(self):
+        """Словарь перечитан или дополнен — выровнять массивы по нему."""
+        if self.words is self.dictionary.words and len(self.rounds) == len(self.words):
+            return
+        if self.words is self.dictionary.words:
+            grow = bytes(4 * (len(self.words) - len(self.rounds)))
+            for col in self.COLUMNS:
+                getattr(self, col).frombytes(grow)
+        else:
+            self._resize(self.played())
+
+    def row(self, i: int) -> tuple[int, ...]:
+        return tuple(getattr(self, col)[i] for col in self.COLUMNS)
+
+    def played(self) -> dict[str, list[int]]:
+        """Только сыгранные слова — так это и хранится."""
+        return {self.words[i]: list(self.row(i)) for i, r in enumerate(self.rounds) if r}
+
+    def record(self, word: str, outcome: str, attempts: int, seconds: float) -> int | None:
+        """Итог раунда по слову: guessed / replaced / skipped / timeout. Возвращает индекс слова."""
+        self.sync()
+        i = self.dictionary.index.get(word)
+        if i is None:
+            return None
+        self.rounds[i] += 1
+        if outcome == "guessed":
+            self.guessed[i] += 1
+            self.attempts[i] += attempts
+            self.seconds[i] += int(seconds)
+        elif outcome == "replaced":
+            self.replaced[i] += 1
+        mark_dirty(self, i)
+        return i
+
+    def expected_attempts(self, i: int) -> float:
+        """Сколько попыток обычно нужно; несыгранный раунд — WORD_FAIL_ATTEMPTS."""
+        rounds = self.rounds[i] if i < len(self.rounds) else 0
+        if not rounds:
+            return WORD_PRIOR_ATTEMPTS
+        failed = rounds - self.guessed[i]
+        total = self.attempts[i] + failed * WORD_FAIL_ATTEMPTS + WORD_PRIOR_ATTEMPTS * WORD_PRIOR_ROUNDS
+        return total / (rounds + WORD_PRIOR_ROUNDS)
+
+    def band(self, i: int) -> int:
+        """Уровень сложности 0..len(DIFFICULTY_BOUNDS)."""
+        return bisect_left(DIFFICULTY_BOUNDS, self.expected_attempts(i))
+
+class WordBands:
+    """
+    Слова словаря по уровням сложности — общий на все сессии индекс для
+    ADAPTIVE_WORDS: members[b] — индексы слов уровня b в array('I'),
+    pos — место слова в своём списке, так что переезд слова между
+    уровнями — O(1). Сессии своих пулов не держат: уровень выбирается по
+    BAND_WEIGHTS, слово в нём — случайной пробой по маске used сессии.
+    masks[b] — тот же уровень битовым числом для точного выбора, когда
+    пробы не попадают; строится лениво и правится в move.
+    """
+
+    __slots__ = ("words", "band_of", "pos", "members", "masks")
+
+    def __init__(self):
+        self.words: list[str] = []
+        self.band_of = bytearray()
+        self.pos = array("I")
+        self.members = [array("I") for _ in range(len(DIFFICULTY_BOUNDS) + 1)]
+        self.masks: list[int | None] = [None] * len(self.members)
+
+    def _append(self, i: int, band: int):
+        self.band_of.append(band)
+        self.pos.append(len(self.members[band]))
+        self.members[band].append(i)
+
+    def sync(self):
+        """Словарь перечитан — пересобрать; дополнен — дописать новые слова."""
+        if self.words is not dictionary.words:
+            self.words = dictionary.words
+            self.band_of = bytearray()
+            self.pos = array("I")
+            self.members = [array("I") for _ in range(len(DIFFICULTY_BOUNDS) + 1)]
+        if len(self.band_of) == len(self.words):
+            return
+        word_stats.sync()
+        prior = bisect_left(DIFFICULTY_BOUNDS, WORD_PRIOR_ATTEMPTS)   # несыгранные — почти весь словарь
+        rounds = word_stats.rounds
+        for i in range(len(self.band_of), len(self.words)):
+            self._append(i, word_stats.band(i) if rounds[i] else prior)
+        self.masks = [None] * len(self.members)
+
+    def mask(self, b: int) -> int:
+        """Слова уровня b битовым числом (строится при первом обращении)."""
+        if self.masks[b] is None:
+            self.masks[b] = index_mask(self.members[b])
+        return self.masks[b]
+
+    def move(self, i: int):
+        """Слово сменило уровень сложности — переложить его в другой список."""
+        if i >= len(self.band_of):
+            return
+        old, new = self.band_of[i], word_stats.band(i)
+        if old == new:
+            return
+        src = self.members[old]
+        last = src.pop()
+        if last != i:
+            src[self.pos[i]] = last
+            self.pos[last] = self.pos[i]
+        self.band_of[i] = new
+        self.pos[i] = len(self.members[new])
+        self.members[new].append(i)
+        bit = 1 << i
+        if self.masks[old] is not None:
+            self.masks[old] &= ~bit
+        if self.masks[new] is not None:
+            self.masks[new] |= bit
+
+    def draw(self, used: "UsedWords", target: int) -> int | None:
+        """Свободное слово: уровень — по весу BAND_WEIGHTS × размер уровня, слово — случайно."""
+        self.sync()
+        weights = [
+            BAND_WEIGHTS[min(abs(b - target), len(BAND_WEIGHTS) - 1)] * len(idx)
+            for b, idx in enumerate(self.members)
+        ]
+        while any(weights):
+            b = random.choices(range(len(weights)), weights)[0]
+            i = used.random_free(self.members[b], self.mask(b))
+            if i is not None:
+                return i
+            weights[b] = 0   # в этом уровне сессия всё уже загадала
+        return None
+
+# =========================================================
+#                        РЕЙТИНГ
+# =========================================================
+class Leaderboard:
+    """
+    Упорядоченный индекс очков: отсортированный список ключей (-очки, uid).
+    Место игрока и вставка ищутся бинпоиском, топ-K — срез начала списка.
+    version растёт при каждом изменении — по нему сбрасываются кэши вывода.
+    """
+
+    __slots__ = ("points", "order", "version")
+
+    def __init__(self, scores: dict[int, int]):
+        self.points: dict[int, int] = {}
+        self.order: list[tuple[int, int]] = []
+        self.version = 0
+        self.reset(scores)
+
+    def reset(self, scores: dict[int, int]):
+        self.points = dict(scores)
+        self.order = sorted((-pts, uid) for uid, pts in scores.items())
+        self.version += 1
+
+    def update(self, uid: int, pts: int):
+        old = self.points.get(uid)
+        if old == pts:
+            return
+        if old is not None:
+            del self.order[bisect_left(self.order, (-old, uid))]
+        self.points[uid] = pts
+        insort(self.order, (-pts, uid))
+        self.version += 1
+
+    def rank(self, uid: int) -> int | None:
+        """Место игрока (с 1), None — если очков у него нет."""
+        pts = self.points.get(uid)
+        if pts is None:
+            return None
+        return bisect_left(self.order, (-pts, uid)) + 1
+
+    def top(self, k: int | None = None, offset: int = 0) -> list[tuple[int, int]]:
+        end = None if k is None else offset + k
+        return [(uid, -neg) for neg, uid in self.order[offset:end]]
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+# заполняются в load_state(): при старте бот не ждёт диска
+storage = None
+word_stats: WordStats | None = None
+word_bands: WordBands | None = None   # только при ADAPTIVE_WORDS
+stats: dict = {}
+dictionary: WordDictionary | None = None
+
+# =========================================================
+#                        ТАЙМЕРЫ
+#  Все отложенные действия (напоминания, таймер слова, выгрузка сессий,
+#  сброс на диск, дневной отчёт) — задания одной кучи.
+#  Перевзвод таймера на более поздний срок — O(1): куча
+#  узнаёт о нём, когда дойдёт до старой записи. Пока
+#  заданий нет, scheduler.run() спит без пробуждений.
+# =========================================================
+class Scheduler:
+    def __init__(self):
+        self.heap: list[tuple[float, int, object]] = []   # (срок, seq, ключ)
+        self.jobs: dict[object, list] = {}                # ключ → [срок, срок в куче, seq, fn]
+        self.seq = 0
+        self.wake = asyncio.Event()
+
+    def call_later(self, key, delay: float, fn):
+        """Взвести (или перевзвести) задание key через delay секунд."""
+        when = monotonic() + delay
+        job = self.jobs.get(key)
+        if job is not None and job[1] <= when:
+            # запись в куче наступит раньше — там и перевзведём
+            job[0], job[3] = when, fn
+            return
+        self.seq += 1
+        self.jobs[key] = [when, when, self.seq, fn]
+        heappush(self.heap, (when, self.seq, key))
+        if self.heap[0][1] == self.seq:
+            self.wake.set()
+
+    def call_at(self, key, at: datetime, fn):
+        self.call_later(key, max(0.0, (at - datetime.now()).total_seconds()), fn)
+
+    def cancel(self, key):
+        self.jobs.pop(key, None)
+
+    def pending(self, key) -> bool:
+        return key in self.jobs
+
+    def _run_due(self, now: float):
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, key = heappop(self.heap)
+            job = self.jobs.get(key)
+            if job is None or job[2] != seq:
+                continue   # отменено или перевзведено раньше
+            if job[0] > now:
+                job[1] = job[0]
+                heappush(self.heap, (job[0], seq, key))
+                continue
+            del self.jobs[key]
+            try:
+                result = job[3]()
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as e:
+                logger.warning(f"timer {key} error: {e}")
+
+    async def run(self):
+        while True:
+            self._run_due(monotonic())
+            self.wake.clear()
+            timeout = self.heap[0][0] - monotonic() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+scheduler = Scheduler()
+
+# =========================================================
+#              ОТЛОЖЕННАЯ ЗАПИСЬ (WRITE-BEHIND)
+#  Хэндлеры только помечают данные «грязными», на диск их
+#  сбрасывает таймер "flush" через FLUSH_INTERVAL секунд
+#  после первой правки и main() при остановке. JSON собирается в отдельном потоке.
+# =========================================================
+# что менялось → ключи: "stats" (общая статистика) или сессия (uid с новыми очками)
+_dirty: dict[object, set] = {}
+_flush_lock = asyncio.Lock()
+
+def mark_dirty(target, *keys):
+    _dirty.setdefault(target, set()).update(keys)
+    if not scheduler.pending("flush"):
+        scheduler.call_later("flush", FLUSH_INTERVAL, flush_state)
+
+def _writer(target, keys):
+    """Снять копию данных и вернуть готовую запись для бэкенда хранения."""
+    if target == "stats":
+        return storage.stats_writer(stats)
+    if isinstance(target, WordStats):
+        return target.storage.word_stats_writer(target, keys)
+    return target.storage.scores_writer(target.scores, keys)
+
+def _run_writes(jobs):
+    for job in jobs:
+        job()
+
+async def flush_state():
+    """Сбросить накопленные изменения на диск."""
+    async with _flush_lock:
+        if not _dirty:
+            return
+        pending = dict(_dirty)
+        _dirty.clear()
+        # копии снимаем в event loop, сериализуем и пишем — в потоке
+        jobs = [_writer(target, keys) for target, keys in pending.items()]
+        started = monotonic()
+        try:
+            await asyncio.to_thread(_run_writes, jobs)
+            flush_seconds.observe(monotonic() - started)
+        except Exception as e:
+            for target, keys in pending.items():
+                mark_dirty(target, *keys)
+            logger.warning(f"flush_state error: {e}")
+
+# =========================================================
+#                ИСХОДЯЩИЕ СООБЩЕНИЯ (OUTBOX)
+#  Хэндлеры не ждут Telegram: кладут готовый метод
+#  (message.answer(...) без await) в send() и возвращаются.
+#  outbox_loop отправляет по приоритету, держит лимиты
+#  через token bucket на каждый чат и общий, а на 429
+#  ждёт retry_after и повторяет тот же запрос.
+# =========================================================
+PRIO_HIGH, PRIO_NORMAL, PRIO_LOW = 0, 1, 2  # итоги раундов / ответы на команды / удаление команд
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд до свободного токена (0 — можно слать)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class ChatLane:
+    """Очереди одного чата: по deque на приоритет, склейка по ключу."""
+    __slots__ = ("queues", "keyed", "bucket", "busy", "blocked_until")
+
+    def __init__(self, chat_id: int):
+        self.queues = (deque(), deque(), deque())
+        self.keyed = {}              # key → [prio, method, key] ещё в очереди
+        # в группах Telegram пускает ~20 сообщений в минуту, в личке ~1 в секунду
+        if chat_id < 0:
+            self.bucket = TokenBucket(OUTBOX_GROUP_RATE, OUTBOX_GROUP_BURST)
+        else:
+            self.bucket = TokenBucket(1.0, 1)
+        self.busy = False            # запрос этого чата уже в полёте
+        self.blocked_until = 0.0     # retry_after от Telegram
+
+    def pending(self) -> bool:
+        return any(self.queues)
+
+    def next_prio(self) -> int:
+        return next(prio for prio, q in enumerate(self.queues) if q)
+
+    def push(self, prio: int, method, key=None, front: bool = False):
+        if key is not None:
+            entry = self.keyed.get(key)
+            if entry is not None:
+                # такое уведомление уже ждёт отправки — оставляем последнее
+                entry[1] = method
+                return
+        entry = [prio, method, key]
+        if key is not None:
+            self.keyed[key] = entry
+        if front:
+            self.queues[prio].appendleft(entry)
+        else:
+            self.queues[prio].append(entry)
+
+    def pop(self):
+        for q in self.queues:
+            if q:
+                entry = q.popleft()
+                if entry[2] is not None:
+                    self.keyed.pop(entry[2], None)
+                return entry
+        return None
+
+class Outbox:
+    def __init__(self):
+        self.lanes: dict[int, ChatLane] = {}
+        self.bucket = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self.wake = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def put(self, method, prio: int = PRIO_NORMAL, key=None):
+        chat_id = getattr(method, "chat_id", None)
+        chat_id = chat_id if isinstance(chat_id, int) else 0
+        lane = self.lanes.get(chat_id)
+        if lane is None:
+            lane = self.lanes[chat_id] = ChatLane(chat_id)
+        if key is not None:
+            # темы одного чата делят очередь, но уведомления у каждой свои
+            key = (key, getattr(method, "message_thread_id", None))
+        lane.push(prio, method, key)
+        self.idle.clear()
+        self.wake.set()
+
+    def _dispatch(self) -> float | None:
+        """Запустить всё, что можно отправить сейчас; вернуть, сколько ждать до следующего."""
+        now = monotonic()
+        wait = None
+        idle = True
+        for chat_id, lane in list(self.lanes.items()):
+            if lane.busy:
+                idle = False
+                continue
+            if not lane.pending():
+                if lane.bucket.wait_time(now) == 0 and lane.bucket.tokens >= lane.bucket.burst:
+                    del self.lanes[chat_id]   # чат затих, лимит восстановился
+                continue
+            idle = False
+            # удаления в лимит сообщений группы не входят
+            metered = lane.next_prio() != PRIO_LOW
+            delay = max(lane.blocked_until - now,
+                        lane.bucket.wait_time(now) if metered else 0,
+                        self.bucket.wait_time(now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if metered:
+                lane.bucket.take()
+            self.bucket.take()
+            lane.busy = True
+            asyncio.create_task(self._send(lane, lane.pop()))
+        if idle:
+            self.idle.set()
+        return wait
+
+    async def _send(self, lane: ChatLane, entry: list):
+        prio, method, key = entry
+        try:
+            await method
+        except TelegramRetryAfter as e:
+            # Telegram сам сказал, сколько ждать — ставим запрос обратно в начало
+            lane.blocked_until = monotonic() + e.retry_after
+            lane.push(prio, method, key, front=True)
+            logger.warning(f"outbox: flood limit, retry after {e.retry_after}s")
+        except Exception as e:
+            # удалить команду часто нельзя (нет прав, уже удалена) — это не ошибка
+            log = logger.debug if prio == PRIO_LOW else logger.warning
+            log(f"outbox: {type(method).__name__} failed: {e}")
+        finally:
+            lane.busy = False
+            self.wake.set()
+
+    async def run(self):
+        while True:
+            wait = self._dispatch()
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, timeout: float = 10):
+        """Дождаться отправки очереди (при остановке бота)."""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("outbox: не всё отправлено до остановки")
+
+outbox = Outbox()
+
+def send(method, prio: int = PRIO_NORMAL, key=None):
+    """Поставить метод Telegram в очередь. key — склеивать одинаковые уведомления."""
+    outbox.put(method, prio, key)
+
+# =========================================================
+#                  ЖУРНАЛ СОБЫТИЙ (JSONL)
+#  events.jsonl — по строке на событие игры: старт/стоп
+#  раунда, попытка, победа, штраф, смена слова, ручная
+#  правка очков, снимок. Хэндлеры только кладут событие в
+#  очередь; пишет journal.run() пачками в отдельном потоке
+#  (flush после каждой пачки), fsync — таймер через
+#  EVENTS_FSYNC_INTERVAL после первой несинхронной пачки, при
+#  EVENTS_MAX_BYTES файл уезжает в events.jsonl.1 (.1 → .2 …
+#  до EVENTS_KEEP), а новый начинается со снимков очков.
+# =========================================================
+class EventJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self.queue: asyncio.Queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.lock = asyncio.Lock()   # файл трогает один поток за раз
+        self.file = None
+        self.size = None             # узнаем при первом открытии
+
+    @staticmethod
+    def record(event: str, s: "GameSession | None" = None, **fields) -> dict:
+        # порядок ключей фиксирован: replay_* отсеивают строки по подстроке до json.loads
+        record = {"ts": datetime.now().isoformat(timespec="milliseconds"), "event": event}
+        if s is not None:
+            record["chat"] = s.chat_id
+            record["thread"] = s.thread_id
+        record.update(fields)
+        return record
+
+    def log(self, event: str, s: "GameSession | None" = None, **fields):
+        """Записать событие. Очередь полна — событие теряется, игра не ждёт."""
+        try:
+            self.queue.put_nowait(self.record(event, s, **fields))
+        except asyncio.QueueFull:
+            events_dropped.inc()
+
+    def snapshot(self, s: "GameSession | None" = None):
+        """Снимок очков сессии (или общей статистики): с него начинается replay."""
+        if s is None:
+            self.log("snapshot", stats=dict(stats))
+        else:
+            self.log("snapshot", s, scores=dict(s.scores))
+
+    # ---------- в потоке ----------
+    def _open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(EVENTS_KEEP - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._open()
+
+    def _write(self, lines: list[str], sync: bool, rotate: bool = False):
+        if self.file is None:
+            self._open()
+        if rotate:
+            self._rotate()
+        data = "".join(lines)
+        self.file.write(data)
+        self.size += len(data.encode("utf-8"))
+        self.file.flush()   # в ОС каждую пачку; на диск — по таймеру "events_fsync"
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def _fsync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def _close(self):
+        self._fsync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # ---------- в event loop ----------
+    def _batch(self, first: dict) -> list[dict]:
+        batch = [first]
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    @staticmethod
+    def _encode(records) -> list[str]:
+        return [json.dumps(r, ensure_ascii=False) + "\n" for r in records]
+
+    async def run(self):
+        while True:
+            batch = self._batch(await self.queue.get())
+            rotate = self.size is not None and self.size >= EVENTS_MAX_BYTES
+            if rotate:
+                # в новом файле есть снимки: replay не уходит дальше него. Снимки уже учитывают
+                # события пачки, поэтому идут после неё — иначе replay посчитал бы их дважды
+                batch += [self.record("snapshot", stats=dict(stats))] + [
+                    self.record("snapshot", s, scores=dict(s.scores)) for s in sessions.values()
+                ]
+            try:
+                async with self.lock:
+                    await asyncio.to_thread(self._write, self._encode(batch), rotate, rotate)
+            except Exception as e:
+                logger.warning(f"events journal error: {e}")
+            # fsync — не позже чем через EVENTS_FSYNC_INTERVAL после первой несинхронной пачки
+            if not rotate and not scheduler.pending("events_fsync"):
+                scheduler.call_later("events_fsync", EVENTS_FSYNC_INTERVAL, self.fsync)
+
+    async def fsync(self):
+        try:
+            async with self.lock:
+                await asyncio.to_thread(self._fsync)
+        except Exception as e:
+            logger.warning(f"events journal error: {e}")
+
+    async def close(self):
+        """Дописать очередь и закрыть файл (при остановке бота)."""
+        batch = self._batch(self.queue.get_nowait()) if not self.queue.empty() else []
+        try:
+            async with self.lock:
+                if batch:
+                    await asyncio.to_thread(self._write, self._encode(batch), False)
+                await asyncio.to_thread(self._close)
+        except Exception as e:
+            logger.warning(f"events journal error: {e}")
+
+journal = EventJournal(EVENTS_FILE)
+
+# =========================================================
+#               ВОССТАНОВЛЕНИЕ ИЗ ЖУРНАЛА
+#  Если scores.json / stats.json не читаются, состояние
+#  собирается заново проигрыванием events.jsonl*: конвейер
+#  генераторов (файлы → строки → отсев по подстроке →
+#  json.loads → свёртка). Начинаем с последнего файла, где
+#  есть снимок нужной сессии, — так replay ограничен одним-
+#  двумя файлами, а не всей историей.
+# =========================================================
+def journal_files() -> list[str]:
+    """Файлы журнала от старых к новым."""
+    paths = [f"{EVENTS_FILE}.{i}" for i in range(EVENTS_KEEP, 0, -1)] + [EVENTS_FILE]
+    return [p for p in paths if os.path.exists(p)]
+
+def files_since_snapshot(marker: str) -> list[str]:
+    """Хвост журнала, начиная с последнего файла, где встречается marker снимка."""
+    files = journal_files()
+    for i in range(len(files) - 1, -1, -1):
+        with open(files[i], "r", encoding="utf-8", errors="replace") as f:
+            if marker in f.read():
+                return files[i:]
+    return files
+
+def read_lines(paths):
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            yield from f
+
+def parse_events(lines):
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue   # оборванная при падении последняя строка
+
+def scope_key(scope: str) -> tuple[int, int]:
+    """Обратно к session_scope(): "" — домашняя сессия, иначе "<chat>_<thread>"."""
+    if not scope:
+        return HOME
+    chat, thread = scope.rsplit("_", 1)
+    return (int(chat), int(thread))
+
+def replay_scores(key: tuple[int, int]) -> dict[int, int]:
+    """Очки сессии по журналу: снимок, затем итоги побед, штрафов и правок."""
+    owner = f'"chat": {key[0]}, "thread": {key[1]},'
+    lines = (
+        line for line in read_lines(files_since_snapshot(f'"event": "snapshot", {owner}'))
+        if owner in line and ('"total"' in line or '"snapshot"' in line or '"scores_reset"' in line)
+    )
+    scores: dict[int, int] = {}
+    n = 0
+    for ev in parse_events(lines):
+        n += 1
+        kind = ev["event"]
+        if kind == "snapshot":
+            scores = {int(uid): pts for uid, pts in ev["scores"].items()}
+        elif kind == "scores_reset":
+            scores = {}
+        else:
+            scores[ev["uid"]] = ev["total"]
+    logger.warning(f"Очки {key} восстановлены из журнала: событий {n}, игроков {len(scores)}")
+    return scores
+
+def replay_stats() -> dict:
+    """Статистика по журналу: снимок, затем победы и дневные отчёты."""
+    lines = (
+        line for line in read_lines(files_since_snapshot('"event": "snapshot", "stats"'))
+        if '"win"' in line or '"stats"' in line or '"daily_report"' in line
+    )
+    st = {"total_guessed": 0, "today_guessed": 0, "today_date": str(date.today())}
+    for ev in parse_events(lines):
+        kind = ev["event"]
+        if kind == "snapshot":
+            if "stats" in ev:
+                st = dict(ev["stats"])
+        elif kind == "daily_report":
+            st["today_guessed"] = 0
+            st["today_date"] = ev["ts"][:10]
+        elif kind == "win":
+            day = ev["ts"][:10]
+            if day != st.get("today_date"):
+                st["today_date"] = day
+                st["today_guessed"] = 0
+            st["total_guessed"] = int(st.get("total_guessed", 0)) + 1
+            st["today_guessed"] = int(st.get("today_guessed", 0)) + 1
+    logger.warning(f"Статистика восстановлена из журнала: угадано всего {st['total_guessed']}")
+    return fresh_stats(st)
+
+def replay_used(key: tuple[int, int]):
+    """Слова, уже загаданные в сессии (обычные раунды и замены кнопкой), по всему журналу."""
+    owner = f'"chat": {key[0]}, "thread": {key[1]},'
+    lines = (
+        line for line in read_lines(journal_files())
+        if owner in line and (
+            '"round_start"' in line and '"special": false' in line or '"word_replace"' in line
+        )
+    )
+    return (ev["new"] if ev["event"] == "word_replace" else ev["word"] for ev in parse_events(lines))
+
+def load_stats_or_replay(storage) -> dict:
+    try:
+        return storage.load_stats()
+    except CorruptFile:
+        return replay_stats()
+
+# =========================================================
+#                      СЕССИИ ИГРЫ
+#  Своя игра в каждом чате/теме: ключ (chat_id, thread_id).
+#  Домашняя сессия (CHAT_ID, THREAD_ID) живёт на старых
+#  файлах; остальные (MULTI_CHAT=1) — в своём scope хранилища
+#  и выгружаются из памяти после SESSION_IDLE_HOURS простоя.
+# =========================================================
+# состояния раунда: idle → active → resolving → active (или idle)
+ROUND_IDLE, ROUND_ACTIVE, ROUND_RESOLVING = "idle", "active", "resolving"
+
+class GameSession:
+    """
+    Раунд, очки и использованные слова одного чата/темы. Словарь и статистика — общие.
+
+    Переходы раунда, в которых есть await, выполняются под lock.
+    Верный ответ переводит раунд в resolving сразу, до первого await,
+    поэтому остальные сообщения отсекаются проверкой state без лока,
+    а раунд засчитывается ровно один раз.
+    """
+
+    __slots__ = (
+        "chat_id", "thread_id", "storage", "lock", "last_activity",
+        "state", "word", "matcher", "leader_id", "attempts", "special", "special_reward",
+        "word_open", "word_started", "difficulty", "roster",
+        "scores", "leaderboard", "used", "dict_gen",
+        "score_pages", "score_pages_version",
+    )
+
+    def __init__(self, chat_id: int, thread_id: int, storage):
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.storage = storage
+        self.lock = asyncio.Lock()
+        self.last_activity = datetime.now()
+
+        self.state = ROUND_IDLE
+        self.word = None
+        self.matcher = None
+        self.leader_id = None
+        self.attempts = 0
+        self.special = False         # спец-раунд?
+        self.special_reward = 10     # награда за спец-слово
+        self.word_open = False       # итог текущего слова ещё не записан в word_stats
+        self.word_started = 0.0
+        self.difficulty = float(bisect_left(DIFFICULTY_BOUNDS, WORD_PRIOR_ATTEMPTS))  # целевой уровень
+        self.roster: dict[int, None] = {}   # недавние игроки по порядку — очередь на ведущего
+
+        try:
+            self.scores: dict[int, int] = storage.load_scores()
+        except CorruptFile:
+            self.scores = replay_scores(self.key)
+            storage.scores_writer(self.scores, set(self.scores))()
+        self.leaderboard = Leaderboard(self.scores)
+        self.used = UsedWords(dictionary, storage)
+        self.used.load()
+        self.dict_gen = dictionary.generation
+
+        self.score_pages: dict[int, str] = {}
+        self.score_pages_version = -1
+
+    @property
+    def active(self) -> bool:
+        return self.state != ROUND_IDLE
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return (self.chat_id, self.thread_id)
+
+    @property
+    def thread_arg(self) -> int | None:
+        """message_thread_id для send_message (0 — без темы)."""
+        return self.thread_id or None
+
+    def set_word(self, word: str):
+        self.word = word
+        self.matcher = make_matcher(word)
+        self.attempts = 0
+        self.word_open = True
+        self.word_started = monotonic()
+
+    def finish_word(self, outcome: str):
+        """Записать итог слова (guessed / replaced / skipped / timeout) и подстроить целевой уровень."""
+        if not self.word_open:
+            return
+        self.word_open = False
+        if self.special:
+            return   # спец-слова нет в словаре
+        i = dictionary.index.get(self.word)
+        if i is None:
+            return
+        expected = word_stats.expected_attempts(i)
+        tries = self.attempts + 1
+        word_stats.record(self.word, outcome, tries, monotonic() - self.word_started)
+
+        if outcome == "guessed":
+            self.difficulty += DIFFICULTY_STEP if tries <= expected else -DIFFICULTY_STEP
+        else:
+            self.difficulty -= 2 * DIFFICULTY_STEP
+        self.difficulty = min(max(self.difficulty, 0.0), float(len(DIFFICULTY_BOUNDS)))
+
+        # уровень слова мог смениться — он общий для всех сессий
+        if word_bands is not None:
+            word_bands.move(i)
+
+    @property
+    def target_band(self) -> int:
+        return int(self.difficulty + 0.5)
+
+    def start_round(self, word: str, leader_id: int, special: bool = False):
+        journal.log("round_start", self, leader=leader_id, word=word, special=special)
+        self.finish_word("skipped")   # перезапуск поверх идущего раунда
+        self.state = ROUND_ACTIVE
+        self.set_word(word)
+        self.leader_id = leader_id
+        self.special = special
+        self.special_reward = 10
+        self.arm_timer()
+
+    def arm_timer(self, stage: int = 0):
+        """Таймер слова: ROUND_HINTS подсказок через равные промежутки, затем конец раунда."""
+        if ROUND_SECONDS and not self.special:
+            scheduler.call_later(("round", self.key), ROUND_SECONDS / (ROUND_HINTS + 1),
+                                 partial(round_tick, self, self.matcher, stage))
+        else:
+            scheduler.cancel(("round", self.key))   # спец-раунд — без лимита
+
+    def join(self, uid: int):
+        """Игрок участвует — ставим в очередь на ведущего."""
+        if uid in self.roster:
+            return
+        self.roster[uid] = None
+        if len(self.roster) > ROSTER_SIZE:
+            del self.roster[next(iter(self.roster))]
+
+    def next_leader(self) -> int | None:
+        """Следующий за ведущим игрок из roster (по кругу) или None, если больше некому."""
+        order = list(self.roster)
+        if self.leader_id in self.roster:
+            pos = order.index(self.leader_id)
+            order = order[pos + 1:] + order[:pos]
+        return order[0] if order else None
+
+    def stop_round(self):
+        if self.active:
+            journal.log("round_stop", self, word=self.word)
+        self.finish_word("skipped")
+        scheduler.cancel(("round", self.key))
+        self.state = ROUND_IDLE
+        self.word = None
+        self.matcher = None
+        self.leader_id = None
+        self.attempts = 0
+        self.special = False
+
+    def pick_new_word(self) -> str | None:
+        """Берём новое слово без повторов."""
+        if dictionary.refresh() or self.dict_gen != dictionary.generation:
+            self.used.rebind()
+            self.dict_gen = dictionary.generation
+        if word_bands is not None:
+            idx = word_bands.draw(self.used, self.target_band)
+        else:
+            idx = self.used.random_free()
+        if idx is None:
+            return None
+        w = dictionary.words[idx]
+        self.used.add(w)
+        return w
+
+    def set_score(self, uid: int, pts: int):
+        """Единая точка изменения очков: словарь, рейтинг и отложенная запись."""
+        self.scores[uid] = pts
+        self.leaderboard.update(uid, pts)
+        mark_dirty(self, uid)
+
+    def reset_scores(self):
+        mark_dirty(self, *self.scores)
+        self.scores.clear()
+        self.leaderboard.reset(self.scores)
+
+HOME = (CHAT_ID, THREAD_ID)
+sessions: dict[tuple[int, int], GameSession] = {}
+
+def session_scope(key: tuple[int, int]) -> str:
+    return "" if key == HOME else f"{key[0]}_{key[1]}"
+
+def open_session(key: tuple[int, int]) -> GameSession:
+    """Открыть сессию синхронно — при старте (в потоке load_state)."""
+    s = sessions.get(key)
+    if s is None:
+        s = sessions[key] = GameSession(key[0], key[1], storage.for_scope(session_scope(key)))
+    return s
+
+_opening: dict[tuple[int, int], asyncio.Task] = {}
+
+async def open_session_async(key: tuple[int, int]) -> GameSession:
+    """
+    Открыть сессию из хэндлера. Чтение с диска (а при битом файле —
+    replay журнала) идёт в потоке; одновременные апдейты одного чата
+    ждут одну и ту же загрузку.
+    """
+    s = sessions.get(key)
+    if s is not None:
+        return s
+    task = _opening.get(key)
+    if task is None:
+        task = _opening[key] = asyncio.create_task(asyncio.to_thread(
+            GameSession, key[0], key[1], storage.for_scope(session_scope(key))))
+        task.add_done_callback(lambda _: _opening.pop(key, None))
+    s = await asyncio.shield(task)
+    return sessions.setdefault(key, s)
+
+def session_key(message) -> tuple[int, int] | None:
+    """Ключ сессии для сообщения; None — чат/тема не обслуживаются."""
+    chat = getattr(message, "chat", None)
+    if chat is None:
+        return None
+    thread = getattr(message, "message_thread_id", None) or 0
+    if chat.id == CHAT_ID:
+        if THREAD_ID == 0 or thread == THREAD_ID:
+            return HOME
+    if not MULTI_CHAT or chat.type not in ("group", "supergroup"):
+        return None
+    # в обычных группах message_thread_id бывает у ответов — это не тема
+    if not getattr(message, "is_topic_message", False):
+        thread = 0
+    return (chat.id, thread)
+
+async def get_session(message) -> GameSession | None:
+    """Сессия для команды: открывается (и читается с диска) при первой же команде в чате."""
+    key = session_key(message)
+    return await open_session_async(key) if key else None
+
+def find_session(message) -> GameSession | None:
+    """Уже открытая сессия. Обычные сообщения в чате, где не играют, сессию не создают."""
+    key = session_key(message)
+    return sessions.get(key) if key else None
+
+async def command_session(message) -> GameSession:
+    """Для команд, которые можно слать боту в ЛС: сессия чата или домашняя."""
+    return await get_session(message) or sessions[HOME]
+
+def nudge_idle(s: GameSession):
+    """INACTIVITY_HOURS без активности и игра не идёт — предложить сыграть."""
+    if sessions.get(s.key) is not s:
+        return   # сессию уже выгрузили
+    if not s.active:
+        send(SendMessage(
+            chat_id=s.chat_id,
+            message_thread_id=s.thread_arg,
+            text="🐊 Давно не играли! Может сыграем в Крокодила? Жми /startgame 😄"
+        ).as_(bot), key="nudge")
+    scheduler.call_later(("nudge", s.key), INACTIVITY_HOURS * 3600, partial(nudge_idle, s))
+
+def round_tick(s: GameSession, matcher, stage: int):
+    """Таймер слова: очередная подсказка или, после последней, конец раунда и смена ведущего."""
+    if sessions.get(s.key) is not s or s.state != ROUND_ACTIVE or s.matcher is not matcher:
+        return   # слово уже угадали/сменили или раунд остановлен
+    if stage < ROUND_HINTS:
+        send(SendMessage(
+            chat_id=s.chat_id,
+            message_thread_id=s.thread_arg,
+            text=f"⏳ Осталось {ROUND_SECONDS * (ROUND_HINTS - stage) // (ROUND_HINTS + 1)} с.\n"
+                 + hint_text(matcher.answer, stage + 1),
+        ).as_(bot), key="round_hint")
+        s.arm_timer(stage + 1)
+        return
+
+    word = s.word
+    journal.log("round_timeout", s, leader=s.leader_id, word=word, attempts=s.attempts)
+    s.finish_word("timeout")
+    text = f"⏰ Время вышло! Слово было <b>{word}</b>."
+    leader = s.next_leader()
+    new_word = s.pick_new_word() if leader else None
+    if new_word:
+        s.start_round(new_word, leader)
+        text += f"\n👉 Новый ведущий: {mention_uid(leader)}"
+        markup = leader_keyboard(leader)
+    else:
+        s.stop_round()
+        text += "\nИгра остановлена — жми /startgame, чтобы начать заново."
+        markup = None
+    send(SendMessage(
+        chat_id=s.chat_id,
+        message_thread_id=s.thread_arg,
+        text=text,
+        reply_markup=markup,
+    ).as_(bot), PRIO_HIGH)
+
+def evict_idle(s: GameSession):
+    """Выгрузить сессию чужого чата после SESSION_IDLE_HOURS простоя (без раунда и несохранённых очков)."""
+    if sessions.get(s.key) is not s:
+        return
+    if s.active or s in _dirty:
+        scheduler.call_later(("evict", s.key), SESSION_IDLE_HOURS * 3600, partial(evict_idle, s))
+        return
+    journal.snapshot(s)   # последние очки сессии остаются в журнале
+    del sessions[s.key]
+    scheduler.cancel(("nudge", s.key))
+
+def load_state():
+    """Хранилище, статистика, словарь и домашняя сессия. Выполняется в потоке при старте."""
+    global storage, dictionary, word_stats, word_bands
+    storage = make_storage()
+    try:
+        stats.update(storage.load_stats())
+    except CorruptFile:
+        stats.update(replay_stats())
+        storage.stats_writer(stats)()
+    dictionary = WordDictionary(storage)
+    dictionary.refresh(force=True)
+    word_stats = WordStats(dictionary, storage)
+    word_stats.load()
+    if ADAPTIVE_WORDS:
+        word_bands = WordBands()
+        word_bands.sync()
+    open_session(HOME)
+
+state_ready = asyncio.Event()
+
+@dp.update.outer_middleware()
+async def wait_for_state(handler, event, data):
+    # polling/вебхук стартуют сразу; апдейты, пришедшие во время загрузки, ждут её
+    if not state_ready.is_set():
+        await state_ready.wait()
+    return await handler(event, data)
+
+# =========================================================
+#                    КЭШ ИМЁН ИГРОКОВ
+#  Заполняется из from_user каждого входящего апдейта;
+#  чего нет (или устарело) — добираем get_chat_member
+#  параллельно, не больше NAME_LOOKUP_CONCURRENCY за раз.
+# =========================================================
+_user_names: dict[int, tuple[str, float]] = {}   # uid → (имя, когда узнали)
+
+def display_name(user) -> str:
+    return f"@{user.username}" if user.username else user.full_name
+
+def remember_user(user):
+    if user and not user.is_bot:
+        _user_names[user.id] = (display_name(user), monotonic())
 
-last_activity_ts = datetime.now()
+async def resolve_names(uids, chat_id: int = CHAT_ID) -> dict[int, str]:
+    """uid → имя для рейтинга; сеть трогаем только для промахов кэша."""
+    now = monotonic()
+    missing = [
+        uid for uid in uids
+        if uid not in _user_names or now - _user_names[uid][1] > USER_NAME_TTL
+    ]
+    if missing:
+        sem = asyncio.Semaphore(NAME_LOOKUP_CONCURRENCY)
+
+        async def fetch(uid: int):
+            async with sem:
+                try:
+                    m = await bot.get_chat_member(chat_id, uid)
+                    remember_user(m.user)
+                except Exception as e:
+                    # не долбим API повторно: оставляем что было (или ID) ещё на TTL
+                    logger.debug(f"get_chat_member({uid}) failed: {e}")
+                    old = _user_names.get(uid, (f"ID:{uid}", 0))[0]
+                    _user_names[uid] = (old, monotonic())
+
+        await asyncio.gather(*(fetch(uid) for uid in missing))
+
+    return {uid: _user_names[uid][0] for uid in uids}
+
+@dp.message.outer_middleware()
+@dp.callback_query.outer_middleware()
+async def remember_sender(handler, event, data):
+    remember_user(event.from_user)
+    return await handler(event, data)
 
 # =========================================================
 #                       ВСПОМОГАТЕЛЬНОЕ
 # =========================================================
+_NON_LETTERS = re.compile(r"[\W\d_]+")
+_HAS_LETTER = re.compile(r"[^\W\d_]")
+
 def normalize(text: str) -> str:
     """Нормализация: нижний регистр, ё→е, только буквы."""
     t = text.lower().replace("ё", "е")
-    return "".join(ch for ch in t if ch.isalpha())
+    # обычно это одно слово без знаков — тогда обходимся без регулярки
+    return t if t.isalpha() else _NON_LETTERS.sub("", t)
+
+class GuessMatcher:
+    """
+    Проверка догадок в пределах одного раунда. Ответ нормализуется один раз,
+    а почти все промахи отсекаются ещё до нормализации сообщения:
+    по длине и по набору букв ответа.
+    """
+
+    __slots__ = ("word", "answer", "chars", "roots")
+
+    def __init__(self, word: str):
+        self.word = word
+        self.answer = normalize(word)
+        self.chars = tuple(set(self.answer))
+        self.roots = RootIndex(self.answer)
+
+    def matches(self, text: str) -> bool:
+        # при спец-слове можно засчитывать вхождение (на случай фраз)
+        if not self.answer or len(text) < len(self.answer):
+            return False
+        t = text.lower().replace("ё", "е")
+        for ch in self.chars:
+            if ch not in t:
+                return False
+        guess = t if t.isalpha() else _NON_LETTERS.sub("", t)
+        return guess == self.answer or self.answer in guess
+
+    def check(self, text: str) -> int:
+        return GUESS_HIT if self.matches(text) else GUESS_MISS
+
+GUESS_MISS, GUESS_NEAR, GUESS_HIT = 0, 1, 2
+GUESS_NAMES = ("miss", "near", "hit")   # метка для метрик
+
+# окончания существительных/прилагательных, длинные — первыми
+_ENDINGS = sorted(
+    "ями ами ого его ому ему ыми ими ях ах ов ев ей ом ем ой ий ый ая яя ое ее ие ые ую юю ью ия ья "
+    "а я о е и ы у ю ь й".split(),
+    key=len, reverse=True,
+)
+
+def stem(word: str) -> str:
+    """Очень грубый стемминг: отрезаем окончание, оставляя основу от 3 букв."""
+    for end in _ENDINGS:
+        if word.endswith(end) and len(word) - len(end) >= 3:
+            return word[:-len(end)]
+    return word
+
+def bounded_distance(a: str, b: str, k: int) -> int:
+    """Расстояние Левенштейна, если оно ≤ k, иначе k + 1. Считаем только полосу |i - j| ≤ k."""
+    n, m = len(a), len(b)
+    big = k + 1
+    if abs(n - m) > k:
+        return big
+    prev = [j if j <= k else big for j in range(m + 1)]
+    for i in range(1, n + 1):
+        cur = [big] * (m + 1)
+        if i <= k:
+            cur[0] = i
+        lo, hi = max(1, i - k), min(m, i + k)
+        ai = a[i - 1]
+        for j in range(lo, hi + 1):
+            d = min(prev[j - 1] + (ai != b[j - 1]), prev[j] + 1, cur[j - 1] + 1)
+            cur[j] = d if d < big else big
+        if min(cur[lo - 1:hi + 1]) > k:
+            return big
+        prev = cur
+    return prev[m]
+
+class FuzzyMatcher(GuessMatcher):
+    """
+    Режим FUZZY_GUESS: кроме точного ответа засчитываем словоформу
+    (та же основа) и опечатку в одну букву, а расстояние 2 — «почти».
+    Всё, что зависит от ответа, считается один раз за раунд; слово
+    из сообщения сначала проходит фильтр по длине и биграммам
+    (каждая правка портит не больше двух биграмм), и только потом —
+    ленточный Левенштейн.
+    """
+
+    __slots__ = ("stem", "bigrams", "typo", "near", "spread", "near_told")
+
+    MAX_TOKENS = 20
+
+    def __init__(self, word: str):
+        super().__init__(word)
+        self.stem = stem(self.answer)
+        self.bigrams = {self.answer[i:i + 2] for i in range(len(self.answer) - 1)}
+        # короткие слова опечаток не прощают: «кошка» ≠ «мошка»
+        self.typo = 1 if len(self.answer) >= 6 else 0
+        self.near = 2 if len(self.answer) >= 6 else 1
+        # насколько длина слова может отличаться от ответа
+        self.spread = max(self.near, len(self.answer) - len(self.stem) + 3)
+        self.near_told: set[int] = set()   # кому уже сказали «почти» в этом раунде
+
+    def _token_verdict(self, t: str) -> int:
+        a = self.answer
+        if abs(len(t) - len(a)) > self.spread:
+            return GUESS_MISS
+        if stem(t) == self.stem:
+            return GUESS_HIT
+        shared = sum(1 for i in range(len(t) - 1) if t[i:i + 2] in self.bigrams)
+        if shared < max(len(t), len(a)) - 1 - 2 * self.near:
+            return GUESS_MISS
+        d = bounded_distance(t, a, self.near)
+        if d <= self.typo:
+            return GUESS_HIT
+        return GUESS_NEAR if d <= self.near else GUESS_MISS
+
+    def check(self, text: str) -> int:
+        if self.matches(text):
+            return GUESS_HIT
+        if len(self.answer) < 4:
+            return GUESS_MISS
+        verdict = GUESS_MISS
+        shortest = len(self.answer) - self.spread
+        for raw in text.split()[:self.MAX_TOKENS]:
+            # после нормализации слово только короче — явно короткие не трогаем
+            if len(raw) < shortest:
+                continue
+            v = self._token_verdict(normalize(raw))
+            if v == GUESS_HIT:
+                return v
+            verdict = max(verdict, v)
+        return verdict
+
+def make_matcher(word: str) -> GuessMatcher:
+    return FuzzyMatcher(word) if FUZZY_GUESS else GuessMatcher(word)
 
 def mention_html(user) -> str:
     name = (user.full_name or "игрок").replace("<", "").replace(">", "")
     return f'<a href="tg://user?id={user.id}">{name}</a>'
 
+def mention_uid(uid: int) -> str:
+    """Упоминание по id, когда под рукой нет User (имя — из кэша имён)."""
+    name = _user_names.get(uid, ("игрок", 0))[0].replace("<", "").replace(">", "")
+    return f'<a href="tg://user?id={uid}">{name}</a>'
+
+def hint_text(answer: str, opened: int) -> str:
+    """Подсказка: длина слова и маска с первыми opened буквами (не больше половины)."""
+    n = len(answer)
+    opened = max(1, min(opened, n // 2))
+    mask = " ".join(answer[:opened]) + " " + "_ " * (n - opened)
+    return (
+        f"💡 Подсказка:\n"
+        f"Слово из {n} букв.\n"
+        f"Начинается на <b>{answer[:opened].upper()}</b>\n"
+        f"<code>{mask}</code>"
+    )
+
 def in_target_topic(message: Message) -> bool:
-    if not message.chat or message.chat.id != CHAT_ID:
-        return False
-    if THREAD_ID == 0:
-        return True
-    return getattr(message, "message_thread_id", None) == THREAD_ID
+    return session_key(message) is not None
 
 def is_super_by_username(username: str | None) -> bool:
     if not username:
@@ -151,20 +2378,48 @@ def is_super(user_obj) -> bool:
     username = user_obj.from_user.username
     return is_super_by_username(username)
 
-async def is_admin(user_id: int) -> bool:
-    try:
-        m = await bot.get_chat_member(CHAT_ID, user_id)
-        return m.status in ("administrator", "creator", "owner")
-    except:
-        return False
+ADMIN_STATUSES = ("administrator", "creator", "owner")
 
-async def maybe_delete_command(message: Message):
-    """Удаляем команды из темы, если есть права."""
-    try:
-        if in_target_topic(message) and message.text and message.text.startswith("/"):
-            await message.delete()
-    except:
-        pass
+# chat_id → (id админов, когда загрузили); обновляется в фоне
+# через get_chat_administrators и точечно — по апдейтам chat_member
+_admins: dict[int, tuple[set[int], float]] = {}
+_admin_refresh: dict[int, asyncio.Task] = {}
+
+async def refresh_admins(chat_id: int = CHAT_ID):
+    members = await bot.get_chat_administrators(chat_id)
+    _admins[chat_id] = ({m.user.id for m in members}, monotonic())
+
+def _refresh_admins_later(chat_id: int):
+    task = _admin_refresh.get(chat_id)
+    if task and not task.done():
+        return
+
+    async def run():
+        try:
+            await refresh_admins(chat_id)
+        except Exception as e:
+            logger.warning(f"refresh_admins error: {e}")
+
+    _admin_refresh[chat_id] = asyncio.create_task(run())
+
+async def is_admin(user_id: int, chat_id: int = CHAT_ID) -> bool:
+    entry = _admins.get(chat_id)
+    if entry is None:
+        # первый запрос по чату — ждём загрузку, дальше только из памяти
+        try:
+            await refresh_admins(chat_id)
+        except Exception as e:
+            logger.warning(f"refresh_admins error: {e}")
+            return False
+        entry = _admins[chat_id]
+    elif monotonic() - entry[1] > ADMIN_CACHE_TTL:
+        _refresh_admins_later(chat_id)
+    return user_id in entry[0]
+
+def maybe_delete_command(message: Message):
+    """Удаляем команды из темы, если есть права (в последнюю очередь)."""
+    if in_target_topic(message) and message.text and message.text.startswith("/"):
+        send(message.delete(), PRIO_LOW)
 
 def leader_keyboard(leader_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
@@ -176,47 +2431,103 @@ def leader_keyboard(leader_id: int) -> InlineKeyboardMarkup:
         ]
     )
 
+def update_activity(s: GameSession | None):
+    """Отметить активность и отодвинуть таймеры простоя сессии."""
+    if s is None:
+        return
+    s.last_activity = datetime.now()
+    scheduler.call_later(("nudge", s.key), INACTIVITY_HOURS * 3600, partial(nudge_idle, s))
+    if s.key != HOME:
+        scheduler.call_later(("evict", s.key), SESSION_IDLE_HOURS * 3600, partial(evict_idle, s))
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+# разные схемы транслита сводим к одной
+_LATIN_FOLD = (("kh", "h"), ("x", "h"), ("j", "y"), ("w", "v"), ("iy", "y"), ("yy", "y"))
+
+_PREFIXES = sorted(
+    "по под за на пере при про раз рас вы до от об обо над пред из ис вз вс".split(),
+    key=len, reverse=True,
+)
 
-def pick_new_word(words: list[str]) -> str | None:
-    """Берём новое слово без повторов."""
-    candidates = [w for w in words if w not in used_words]
-    if not candidates:
-        return None
-    w = random.choice(candidates)
-    used_words.add(w)
-    save_used_word(w)
-    return w
+def fold_latin(text: str) -> str:
+    for a, b in _LATIN_FOLD:
+        text = text.replace(a, b)
+    return text
 
-def update_activity():
-    global last_activity_ts
-    last_activity_ts = datetime.now()
+def root_core(word: str) -> str:
+    """Основа без приставки и окончания: «подарок» и «подарки» → одно и то же."""
+    for p in _PREFIXES:
+        if word.startswith(p) and len(word) - len(p) >= 4:
+            word = word[len(p):]
+            break
+    return stem(word)
 
-def detect_root_violation(leader_text: str, answer: str) -> bool:
+class RootIndex:
     """
-    Простейшая проверка однокоренности:
-    - любое слово из сообщения ведущего длиной >=4
-      если оно равно ответу / входит в ответ / имеет общий префикс >=4.
+    Запрещённые для ведущего формы текущего слова, собранные один раз
+    за раунд: все подстроки ответа от 4 букв, первые 4 буквы, основа без
+    приставки — и то же для транслита латиницей. Слово ведущего
+    проверяется поиском в множестве и парой сравнений строк.
     """
-    ans = normalize(answer)
-    if not ans:
-        return False
-    tokens = [normalize(x) for x in leader_text.split()]
-    tokens = [t for t in tokens if len(t) >= 4]
-    for t in tokens:
-        if t == ans:
-            return True
-        if t in ans or ans in t:
-            return True
-        # общий префикс >=4
-        pref = 0
-        for a_ch, b_ch in zip(t, ans):
-            if a_ch == b_ch:
-                pref += 1
-            else:
-                break
-        if pref >= 4:
+
+    __slots__ = ("answer", "subs", "prefix", "core", "latin", "latin_subs", "latin_prefix")
+
+    def __init__(self, answer: str):
+        self.answer = answer
+        self.subs, self.prefix = self._forms(answer)
+        core = root_core(answer)
+        self.core = core if len(core) >= 4 else None
+        self.latin = fold_latin("".join(_TRANSLIT.get(ch, ch) for ch in answer))
+        self.latin_subs, self.latin_prefix = self._forms(self.latin)
+
+    @staticmethod
+    def _forms(word: str) -> tuple[set[str], str | None]:
+        n = len(word)
+        subs = {word[i:j] for i in range(n) for j in range(i + 4, n + 1)}
+        return subs, (word[:4] if n >= 4 else None)
+
+    def _violates(self, t: str) -> bool:
+        if t.isascii():
+            t = fold_latin(t)
+            return t in self.latin_subs or self.latin in t or t[:4] == self.latin_prefix
+        if t in self.subs or self.answer in t or t[:4] == self.prefix:
             return True
-    return False
+        return self.core is not None and root_core(t) == self.core
+
+    def tokens(self, text: str):
+        """Слова сообщения от 4 букв; «я б л о к о» склеиваем в одно слово."""
+        spaced = []
+        for raw in text.split():
+            t = normalize(raw)
+            if len(t) == 1:
+                spaced.append(t)
+                continue
+            if len(spaced) >= 4:
+                yield "".join(spaced)
+            spaced = []
+            if len(t) >= 4:
+                yield t
+        if len(spaced) >= 4:
+            yield "".join(spaced)
+
+    def violated(self, leader_text: str) -> bool:
+        if not self.answer:
+            return False
+        return any(self._violates(t) for t in self.tokens(leader_text))
+
+def detect_root_violation(leader_text: str, answer: str) -> bool:
+    """
+    Проверка однокоренности: любое слово из сообщения ведущего длиной >=4,
+    если оно равно ответу / входит в ответ / содержит его / имеет общий
+    префикс >=4 / совпадает с ним по основе — в том числе латиницей
+    и по буквам через пробел. В раунде используется готовый RootIndex сессии.
+    """
+    return RootIndex(normalize(answer)).violated(leader_text)
 
 def achievement_for(score: int) -> str | None:
     """Простые ачивки."""
@@ -232,110 +2543,146 @@ def achievement_for(score: int) -> str | None:
             return title
     return None
 
+BOT_COMMANDS = [
+    BotCommand(command="startgame", description="Начать игру (становишься ведущим)"),
+    BotCommand(command="restartgame", description="Перезапустить игру (супер/админ)"),
+    BotCommand(command="score", description="Полный рейтинг"),
+    BotCommand(command="top", description="Топ-10"),
+    BotCommand(command="rank", description="Моё место в рейтинге"),
+    BotCommand(command="addword", description="Добавить слово (админ)"),
+    BotCommand(command="importwords", description="Добавить слова из файла (админ)"),
+    BotCommand(command="say", description="Сказать от имени бота (админ)"),
+    BotCommand(command="special", description="Спец-слово (только @yakovlef)"),
+    BotCommand(command="addpoints", description="Добавить очки (только @yakovlef)"),
+    BotCommand(command="delpoints", description="Убрать очки (только @yakovlef)"),
+    BotCommand(command="passlead", description="Передать ход (только @yakovlef)"),
+    BotCommand(command="hint", description="Подсказка (ведущий)"),
+    BotCommand(command="resetgame", description="Сброс игры и рейтинга (только @yakovlef)"),
+    BotCommand(command="info", description="Показать chat_id / thread_id"),
+]
+
 async def setup_commands():
-    commands = [
-        BotCommand(command="startgame", description="Начать игру (становишься ведущим)"),
-        BotCommand(command="restartgame", description="Перезапустить игру (супер/админ)"),
-        BotCommand(command="score", description="Полный рейтинг"),
-        BotCommand(command="top", description="Топ-10"),
-        BotCommand(command="addword", description="Добавить слово (админ)"),
-        BotCommand(command="say", description="Сказать от имени бота (админ)"),
-        BotCommand(command="special", description="Спец-слово (только @yakovlef)"),
-        BotCommand(command="addpoints", description="Добавить очки (только @yakovlef)"),
-        BotCommand(command="delpoints", description="Убрать очки (только @yakovlef)"),
-        BotCommand(command="passlead", description="Передать ход (только @yakovlef)"),
-        BotCommand(command="hint", description="Подсказка (ведущий)"),
-        BotCommand(command="resetgame", description="Сброс игры и рейтинга (только @yakovlef)"),
-        BotCommand(command="info", description="Показать chat_id / thread_id"),
-    ]
-    await bot.set_my_commands(commands)
+    """Обновить меню команд, только если список поменялся с прошлого раза."""
+    digest = str(zlib.crc32(json.dumps(
+        [(c.command, c.description) for c in BOT_COMMANDS], ensure_ascii=False
+    ).encode("utf-8")))
+    if storage.get_meta("commands_crc") == digest:
+        return
+    await bot.set_my_commands(BOT_COMMANDS)
+    storage.set_meta("commands_crc", digest)
+
+# =========================================================
+#              /score ПО СТРАНИЦАМ (С КЭШЕМ)
+#  Страница рендерится при первом запросе и живёт в кэше
+#  сессии, пока не изменится рейтинг (leaderboard.version).
+# =========================================================
+def score_keyboard(page: int, pages: int) -> InlineKeyboardMarkup | None:
+    if pages <= 1:
+        return None
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="◀️", callback_data=f"score:{page - 1}"))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"score:{page}"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton(text="▶️", callback_data=f"score:{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+async def render_score_page(s: GameSession, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    if s.score_pages_version != s.leaderboard.version:
+        s.score_pages.clear()
+        s.score_pages_version = s.leaderboard.version
+
+    pages = max(1, -(-len(s.leaderboard) // SCORE_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    if page not in s.score_pages:
+        offset = page * SCORE_PAGE_SIZE
+        rating = s.leaderboard.top(SCORE_PAGE_SIZE, offset)
+        names = await resolve_names([uid for uid, _ in rating], s.chat_id)
+        medals = ["🥇", "🥈", "🥉"]
+        lines = []
+        for i, (uid, pts) in enumerate(rating, offset + 1):
+            medal = medals[i-1] if i <= 3 else "•"
+            lines.append(f"{medal} {i}. <b>{names[uid]}</b> — {pts}")
+        s.score_pages[page] = "📊 <b>Общий рейтинг:</b>\n" + "\n".join(lines)
+    return s.score_pages[page], score_keyboard(page, pages)
 
 # =========================================================
 #                       КОМАНДЫ
 # =========================================================
 @dp.message(Command("info"))
 async def cmd_info(message: Message):
-    update_activity()
+    update_activity(find_session(message))
     global SUPER_OFFICER_ID
     if is_super(message):
         SUPER_OFFICER_ID = message.from_user.id
 
-    await message.answer(
+    send(message.answer(
         f"{mention_html(message.from_user)}, вот параметры:\n"
         f"<b>chat_id:</b> <code>{message.chat.id}</code>\n"
         f"<b>thread_id:</b> <code>{getattr(message,'message_thread_id',None)}</code>"
-    )
-    await maybe_delete_command(message)
+    ))
+    maybe_delete_command(message)
 
 @dp.message(Command("startgame"))
 async def cmd_startgame(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
     global SUPER_OFFICER_ID
     if is_super(message):
         SUPER_OFFICER_ID = message.from_user.id
 
-    if game["active"]:
-        await message.answer(f"{mention_html(message.from_user)}, игра уже идёт.")
-        await maybe_delete_command(message)
-        return
+    async with s.lock:
+        if s.active:
+            send(message.answer(f"{mention_html(message.from_user)}, игра уже идёт."), key="running")
+            maybe_delete_command(message)
+            return
 
-    words = load_words_list()
-    w = pick_new_word(words)
-    if not w:
-        await message.answer("🎉 Все слова использованы! Очисти used_words.txt.")
-        await maybe_delete_command(message)
-        return
+        w = s.pick_new_word()
+        if not w:
+            send(message.answer("🎉 Все слова использованы! Очисти used_words.txt и used_words.bin."))
+            maybe_delete_command(message)
+            return
 
-    game.update(
-        active=True,
-        word=w,
-        leader_id=message.from_user.id,
-        attempts=0,
-        special=False
-    )
+        s.start_round(w, message.from_user.id)
 
-    await message.answer(
+    send(message.answer(
         f"🎮 Игра началась!\n"
         f"Ведущий: {mention_html(message.from_user)}",
         reply_markup=leader_keyboard(message.from_user.id)
-    )
-    await maybe_delete_command(message)
+    ))
+    maybe_delete_command(message)
 
 @dp.message(Command("restartgame"))
 async def cmd_restartgame(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
-    if not (is_super(message) or await is_admin(message.from_user.id)):
-        await message.answer(f"{mention_html(message.from_user)}, перезапуск доступен только @yakovlef или админам.")
-        await maybe_delete_command(message)
+    if not (is_super(message) or await is_admin(message.from_user.id, s.chat_id)):
+        send(message.answer(f"{mention_html(message.from_user)}, перезапуск доступен только @yakovlef или админам."))
+        maybe_delete_command(message)
         return
 
-    words = load_words_list()
-    w = pick_new_word(words)
-    if not w:
-        await message.answer("🎉 Все слова использованы — перезапуск невозможен.")
-        await maybe_delete_command(message)
-        return
+    # ждём, пока дорешается текущий раунд, чтобы не затереть его итог
+    async with s.lock:
+        w = s.pick_new_word()
+        if not w:
+            send(message.answer("🎉 Все слова использованы — перезапуск невозможен."))
+            maybe_delete_command(message)
+            return
 
-    game.update(
-        active=True,
-        word=w,
-        leader_id=message.from_user.id,
-        attempts=0,
-        special=False
-    )
+        s.start_round(w, message.from_user.id)
 
-    await message.answer(
+    send(message.answer(
         f"♻️ Игра перезапущена!\n"
         f"Новый ведущий: {mention_html(message.from_user)}",
         reply_markup=leader_keyboard(message.from_user.id)
-    )
-    await maybe_delete_command(message)
+    ))
+    maybe_delete_command(message)
 
 @dp.message(Command("special"))
 async def cmd_special(message: Message):
@@ -346,329 +2693,373 @@ async def cmd_special(message: Message):
     - ведущий на спец-слове всегда @yakovlef
     - за угадывание +10 очков
     """
-    update_activity()
+    s = await command_session(message)
+    update_activity(s)
     global SUPER_OFFICER_ID
 
     if not is_super(message):
-        await message.answer(f"{mention_html(message.from_user)}, спец-слово может задать только @yakovlef.")
-        await maybe_delete_command(message)
+        send(message.answer(f"{mention_html(message.from_user)}, спец-слово может задать только @yakovlef."))
+        maybe_delete_command(message)
         return
 
     SUPER_OFFICER_ID = message.from_user.id
 
     parts = (message.text or "").split(maxsplit=1)
     if len(parts) < 2:
-        await message.answer("Использование:\n/special <слово>")
-        await maybe_delete_command(message)
+        send(message.answer("Использование:\n/special <слово>"))
+        maybe_delete_command(message)
         return
 
     special_word = parts[1].strip().lower()
     if len(normalize(special_word)) < 4:
-        await message.answer("❌ Спец-слово должно быть минимум 4 буквы.")
-        await maybe_delete_command(message)
+        send(message.answer("❌ Спец-слово должно быть минимум 4 буквы."))
+        maybe_delete_command(message)
         return
 
     # спец-слово не пишем в used_words — оно отдельное
-    game.update(
-        active=True,
-        word=special_word,
-        leader_id=message.from_user.id,
-        attempts=0,
-        special=True,
-        special_reward=10
-    )
+    async with s.lock:
+        s.start_round(special_word, message.from_user.id, special=True)
 
     # отправляем в тему уведомление
-    try:
-        await bot.send_message(
-            chat_id=CHAT_ID,
-            message_thread_id=THREAD_ID if THREAD_ID != 0 else None,
-            text="⭐ Запущен <b>спец-раунд</b> от @yakovlef! Угадай слово — получишь +10 очков!",
-            reply_markup=leader_keyboard(message.from_user.id)
-        )
-    except:
-        pass
+    send(SendMessage(
+        chat_id=s.chat_id,
+        message_thread_id=s.thread_arg,
+        text="⭐ Запущен <b>спец-раунд</b> от @yakovlef! Угадай слово — получишь +10 очков!",
+        reply_markup=leader_keyboard(message.from_user.id)
+    ).as_(bot), PRIO_HIGH)
 
-    await message.answer("✅ Спец-слово установлено и отправлено в тему.")
-    await maybe_delete_command(message)
+    send(message.answer("✅ Спец-слово установлено и отправлено в тему."))
+    maybe_delete_command(message)
 
 @dp.message(Command("passlead"))
 async def cmd_passlead(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
     if not is_super(message):
-        await message.answer("⛔ Передавать ход может только @yakovlef.")
-        await maybe_delete_command(message)
+        send(message.answer("⛔ Передавать ход может только @yakovlef."))
+        maybe_delete_command(message)
         return
 
     parts = (message.text or "").split()
     if len(parts) < 2:
-        await message.answer("Использование:\n/passlead @username")
-        await maybe_delete_command(message)
+        send(message.answer("Использование:\n/passlead @username"))
+        maybe_delete_command(message)
         return
 
     target = parts[1].lower()
     try:
-        member = await bot.get_chat_member(CHAT_ID, target)
+        member = await bot.get_chat_member(s.chat_id, target)
         new_leader = member.user
     except:
-        await message.answer("❌ Пользователь не найден в группе.")
-        await maybe_delete_command(message)
+        send(message.answer("❌ Пользователь не найден в группе."))
+        maybe_delete_command(message)
         return
 
-    if not game["active"]:
-        await message.answer("⚠️ Игра не идёт.")
-        await maybe_delete_command(message)
+    if s.state != ROUND_ACTIVE:
+        send(message.answer("⚠️ Игра не идёт."), key="not_running")
+        maybe_delete_command(message)
         return
 
-    game["leader_id"] = new_leader.id
+    s.leader_id = new_leader.id
 
-    await message.answer(
+    send(message.answer(
         f"🎯 Ход передан: {mention_html(new_leader)}",
         reply_markup=leader_keyboard(new_leader.id)
-    )
-    await maybe_delete_command(message)
+    ))
+    maybe_delete_command(message)
 
 @dp.message(Command("hint"))
 async def cmd_hint(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
-    if not game["active"] or not game["word"]:
-        await message.answer("Сейчас игра не запущена.")
-        await maybe_delete_command(message)
+    if not s.active or not s.word:
+        send(message.answer("Сейчас игра не запущена."), key="not_running")
+        maybe_delete_command(message)
         return
 
-    if message.from_user.id != game["leader_id"]:
-        await message.answer(f"{mention_html(message.from_user)}, подсказку может давать только ведущий.")
-        await maybe_delete_command(message)
+    if message.from_user.id != s.leader_id:
+        send(message.answer(f"{mention_html(message.from_user)}, подсказку может давать только ведущий."))
+        maybe_delete_command(message)
         return
 
-    word = game["word"]
-    n = len(normalize(word))
-    mask = normalize(word)[0] + " " + "_ " * (n - 1)
-    await message.answer(
-        f"💡 Подсказка:\n"
-        f"Слово из {n} букв.\n"
-        f"Начинается на <b>{normalize(word)[0].upper()}</b>\n"
-        f"<code>{mask}</code>"
-    )
-    await maybe_delete_command(message)
+    send(message.answer(hint_text(s.matcher.answer, 1)))
+    maybe_delete_command(message)
 
 @dp.message(Command("addword"))
 async def cmd_addword(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
-    if not await is_admin(message.from_user.id):
-        await message.answer(f"{mention_html(message.from_user)}, добавлять слова может только админ.")
-        await maybe_delete_command(message)
+    if not await is_admin(message.from_user.id, s.chat_id):
+        send(message.answer(f"{mention_html(message.from_user)}, добавлять слова может только админ."))
+        maybe_delete_command(message)
         return
 
     parts = (message.text or "").split(maxsplit=1)
     if len(parts) < 2:
-        await message.answer("Использование:\n/addword слово")
-        await maybe_delete_command(message)
+        send(message.answer("Использование:\n/addword слово"))
+        maybe_delete_command(message)
         return
 
     w = parts[1].strip().lower()
-    if len(normalize(w)) < 4 or not normalize(w).isalpha():
-        await message.answer("❌ Слово должно быть реальным и минимум 4 буквы.")
-        await maybe_delete_command(message)
+    if check_word(w):
+        send(message.answer(f"❌ Нужно одно слово русскими буквами, от {WORD_MIN_LEN} до {WORD_MAX_LEN} букв."))
+        maybe_delete_command(message)
         return
 
-    words = load_words_list()
-    if w in words:
-        await message.answer("⚠️ Такое слово уже есть.")
-        await maybe_delete_command(message)
+    async with dictionary.lock:
+        added = dictionary.add(w)
+    if not added:
+        send(message.answer(f"⚠️ Такое слово уже есть: <b>{dictionary.find(w)}</b>"))
+        maybe_delete_command(message)
         return
 
-    with open(WORDS_FILE, "a", encoding="utf-8") as f:
-        f.write(w + "\n")
+    send(message.answer(f"✅ Добавлено слово: <b>{w}</b>"))
+    maybe_delete_command(message)
 
-    await message.answer(f"✅ Добавлено слово: <b>{w}</b>")
-    await maybe_delete_command(message)
+@dp.message(Command("importwords"))
+async def cmd_importwords(message: Message):
+    """Файл со словами (в подписи /importwords или ответом на сообщение с файлом)."""
+    s = await get_session(message)
+    if s is None:
+        return
+    update_activity(s)
+
+    if not await is_admin(message.from_user.id, s.chat_id):
+        send(message.answer(f"{mention_html(message.from_user)}, импортировать слова может только админ."))
+        maybe_delete_command(message)
+        return
+
+    doc = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if doc is None:
+        send(message.answer(
+            "Использование: пришли .txt со словами (по слову на строку или через запятую) "
+            "с подписью /importwords или ответь этой командой на сообщение с файлом."
+        ))
+        maybe_delete_command(message)
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        send(message.answer(f"❌ Файл больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ."))
+        maybe_delete_command(message)
+        return
+
+    buf = await bot.download(doc)
+    counts = dict.fromkeys(IMPORT_COUNTERS, 0)
+    lines = io.TextIOWrapper(buf, encoding="utf-8", errors="replace")
+    # разбор, проверка и запись — в потоке; слияние со словарём — в event loop
+    planned = await asyncio.to_thread(lambda: list(import_words(lines, dictionary, counts)))
+    added = await dictionary.add_many_async(planned)
+    counts["duplicate"] += len(planned) - len(added)   # успели добавить, пока читали файл
+    logger.info(f"/importwords: {import_report(counts, len(added))}")
+
+    text = f"📥 Импорт слов: {import_report(counts, len(added))}.\nВ словаре теперь {len(dictionary)} слов."
+    if added:
+        text += "\nНапример: " + ", ".join(added[:10])
+    send(message.answer(text))
+    maybe_delete_command(message)
 
 @dp.message(Command("say"))
 async def cmd_say(message: Message):
-    update_activity()
-    if not await is_admin(message.from_user.id):
-        await message.answer(f"{mention_html(message.from_user)}, /say доступна только админам.")
-        await maybe_delete_command(message)
+    s = await command_session(message)
+    update_activity(s)
+    if not await is_admin(message.from_user.id, s.chat_id):
+        send(message.answer(f"{mention_html(message.from_user)}, /say доступна только админам."))
+        maybe_delete_command(message)
         return
 
     parts = (message.text or "").split(maxsplit=1)
     if len(parts) < 2:
-        await message.answer("Использование:\n/say текст")
-        await maybe_delete_command(message)
+        send(message.answer("Использование:\n/say текст"))
+        maybe_delete_command(message)
         return
 
     text_to_send = parts[1]
-    await bot.send_message(
-        chat_id=CHAT_ID,
-        message_thread_id=THREAD_ID if THREAD_ID != 0 else None,
+    send(SendMessage(
+        chat_id=s.chat_id,
+        message_thread_id=s.thread_arg,
         text=text_to_send
-    )
-    await message.answer("✅ Сообщение отправлено в тему.")
-    await maybe_delete_command(message)
+    ).as_(bot))
+    send(message.answer("✅ Сообщение отправлено в тему."))
+    maybe_delete_command(message)
 
 @dp.message(Command("addpoints"))
 async def cmd_addpoints(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
     if not is_super(message):
-        await message.answer("⛔ Добавлять очки может только @yakovlef.")
-        await maybe_delete_command(message)
+        send(message.answer("⛔ Добавлять очки может только @yakovlef."))
+        maybe_delete_command(message)
         return
 
     parts = (message.text or "").split()
     if len(parts) < 3:
-        await message.answer("Использование:\n/addpoints @user N")
-        await maybe_delete_command(message)
+        send(message.answer("Использование:\n/addpoints @user N"))
+        maybe_delete_command(message)
         return
 
     target = parts[1].lower()
     try:
-        member = await bot.get_chat_member(CHAT_ID, target)
+        member = await bot.get_chat_member(s.chat_id, target)
         user = member.user
     except:
-        await message.answer("❌ Пользователь не найден.")
-        await maybe_delete_command(message)
+        send(message.answer("❌ Пользователь не найден."))
+        maybe_delete_command(message)
         return
 
     try:
         n = int(parts[2])
     except:
-        await message.answer("❌ N должно быть числом.")
-        await maybe_delete_command(message)
+        send(message.answer("❌ N должно быть числом."))
+        maybe_delete_command(message)
         return
 
-    scores[user.id] = scores.get(user.id, 0) + n
-    save_scores(scores)
+    s.set_score(user.id, s.scores.get(user.id, 0) + n)
+    journal.log("points", s, by=message.from_user.id, uid=user.id, delta=n, total=s.scores[user.id])
 
-    await message.answer(f"✅ {mention_html(user)} получил {n} очк(а). Теперь: {scores[user.id]}")
-    await maybe_delete_command(message)
+    send(message.answer(f"✅ {mention_html(user)} получил {n} очк(а). Теперь: {s.scores[user.id]}"))
+    maybe_delete_command(message)
 
 @dp.message(Command("delpoints"))
 async def cmd_delpoints(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
     if not is_super(message):
-        await message.answer("⛔ Убирать очки может только @yakovlef.")
-        await maybe_delete_command(message)
+        send(message.answer("⛔ Убирать очки может только @yakovlef."))
+        maybe_delete_command(message)
         return
 
     parts = (message.text or "").split()
     if len(parts) < 3:
-        await message.answer("Использование:\n/delpoints @user N")
-        await maybe_delete_command(message)
+        send(message.answer("Использование:\n/delpoints @user N"))
+        maybe_delete_command(message)
         return
 
     target = parts[1].lower()
     try:
-        member = await bot.get_chat_member(CHAT_ID, target)
+        member = await bot.get_chat_member(s.chat_id, target)
         user = member.user
     except:
-        await message.answer("❌ Пользователь не найден.")
-        await maybe_delete_command(message)
+        send(message.answer("❌ Пользователь не найден."))
+        maybe_delete_command(message)
         return
 
     try:
         n = int(parts[2])
     except:
-        await message.answer("❌ N должно быть числом.")
-        await maybe_delete_command(message)
+        send(message.answer("❌ N должно быть числом."))
+        maybe_delete_command(message)
         return
 
-    scores[user.id] = max(0, scores.get(user.id, 0) - n)
-    save_scores(scores)
+    s.set_score(user.id, max(0, s.scores.get(user.id, 0) - n))
+    journal.log("points", s, by=message.from_user.id, uid=user.id, delta=-n, total=s.scores[user.id])
 
-    await message.answer(f"✅ У {mention_html(user)} снято {n} очк(а). Теперь: {scores[user.id]}")
-    await maybe_delete_command(message)
+    send(message.answer(f"✅ У {mention_html(user)} снято {n} очк(а). Теперь: {s.scores[user.id]}"))
+    maybe_delete_command(message)
 
 @dp.message(Command("resetgame"))
 async def cmd_resetgame(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
     if not is_super(message):
-        await message.answer("⛔ Сбросить игру может только @yakovlef.")
-        await maybe_delete_command(message)
+        send(message.answer("⛔ Сбросить игру может только @yakovlef."))
+        maybe_delete_command(message)
         return
 
-    game.update(active=False, word=None, leader_id=None, attempts=0, special=False)
-    scores.clear()
-    save_scores(scores)
+    async with s.lock:
+        s.stop_round()
+        s.reset_scores()
+    journal.log("scores_reset", s, by=message.from_user.id)
 
-    await message.answer("♻️ Игра и рейтинг сброшены.")
-    await maybe_delete_command(message)
+    send(message.answer("♻️ Игра и рейтинг сброшены."))
+    maybe_delete_command(message)
 
 @dp.message(Command("score"))
 async def cmd_score(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
-    if not scores:
-        await message.answer("📊 Рейтинг пуст.")
-        await maybe_delete_command(message)
+    if not s.scores:
+        send(message.answer("📊 Рейтинг пуст."))
+        maybe_delete_command(message)
         return
 
-    rating = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    lines = []
-    medals = ["🥇", "🥈", "🥉"]
-
-    for i, (uid, pts) in enumerate(rating, 1):
-        try:
-            m = await bot.get_chat_member(CHAT_ID, uid)
-            u = m.user
-            name = f"@{u.username}" if u.username else u.full_name
-        except:
-            name = f"ID:{uid}"
-
-        medal = medals[i-1] if i <= 3 else "•"
-        lines.append(f"{medal} {i}. <b>{name}</b> — {pts}")
-
-    await message.answer("📊 <b>Общий рейтинг:</b>\n" + "\n".join(lines))
-    await maybe_delete_command(message)
+    text, kb = await render_score_page(s, 0)
+    send(message.answer(text, reply_markup=kb))
+    maybe_delete_command(message)
 
 @dp.message(Command("top"))
 async def cmd_top(message: Message):
-    if not in_target_topic(message):
+    s = await get_session(message)
+    if s is None:
         return
-    update_activity()
+    update_activity(s)
 
-    if not scores:
-        await message.answer("🏆 Пока нет данных.")
-        await maybe_delete_command(message)
+    if not s.scores:
+        send(message.answer("🏆 Пока нет данных."))
+        maybe_delete_command(message)
         return
 
-    rating = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:10]
+    rating = s.leaderboard.top(10)
     lines = []
     medals = ["🥇", "🥈", "🥉"]
 
+    names = await resolve_names([uid for uid, _ in rating], s.chat_id)
     for i, (uid, pts) in enumerate(rating, 1):
-        try:
-            m = await bot.get_chat_member(CHAT_ID, uid)
-            u = m.user
-            name = f"@{u.username}" if u.username else u.full_name
-        except:
-            name = f"ID:{uid}"
-
+        name = names[uid]
         medal = medals[i-1] if i <= 3 else "•"
         lines.append(f"{medal} {i}. <b>{name}</b> — {pts}")
 
-    await message.answer("🏆 <b>Топ-10 игроков:</b>\n" + "\n".join(lines))
-    await maybe_delete_command(message)
+    send(message.answer("🏆 <b>Топ-10 игроков:</b>\n" + "\n".join(lines)))
+    maybe_delete_command(message)
+
+@dp.message(Command("rank"))
+async def cmd_rank(message: Message):
+    s = await get_session(message)
+    if s is None:
+        return
+    update_activity(s)
+
+    uid = message.from_user.id
+    place = s.leaderboard.rank(uid)
+    if place is None:
+        send(message.answer(f"{mention_html(message.from_user)}, у тебя пока нет очков."))
+    else:
+        send(message.answer(
+            f"📍 {mention_html(message.from_user)}, твоё место: <b>{place}</b> из {len(s.leaderboard)}\n"
+            f"💎 Очков: <b>{s.scores[uid]}</b>"
+        ))
+    maybe_delete_command(message)
+
+@dp.chat_member()
+async def on_chat_member(update: ChatMemberUpdated):
+    """Назначили/сняли админа — правим кэш сразу, не дожидаясь TTL."""
+    entry = _admins.get(update.chat.id)
+    if entry is None:
+        return
+    uid = update.new_chat_member.user.id
+    if update.new_chat_member.status in ADMIN_STATUSES:
+        entry[0].add(uid)
+    else:
+        entry[0].discard(uid)
 
 # =========================================================
 #                 CALLBACK-КНОПКИ ВЕДУЩЕГО
@@ -676,32 +3067,54 @@ async def cmd_top(message: Message):
 # =========================================================
 @dp.callback_query()
 async def callbacks(call: CallbackQuery):
-    if not call.message or not in_target_topic(call.message):
+    data = call.data or ""
+
+    # листание /score доступно всем и не зависит от игры; сессию открываем —
+    # после перезапуска или вытеснения кнопки старой таблицы должны работать
+    if data.startswith("score:"):
+        s = await get_session(call.message) if call.message else None
+        try:
+            page = int(data.split(":", 1)[1])
+        except ValueError:
+            page = None
+        if s is None or page is None:
+            await call.answer()
+            return
+        text, kb = await render_score_page(s, page)
+        try:
+            await call.message.edit_text(text, reply_markup=kb)
+        except Exception as e:
+            # «message is not modified» при нажатии на текущую страницу
+            logger.debug(f"score page edit skipped: {e}")
+        await call.answer()
         return
-    if not game["active"] or not game["leader_id"]:
+
+    s = find_session(call.message) if call.message else None
+    if s is None or not s.active or not s.leader_id:
         await call.answer("Игра сейчас не запущена.", show_alert=True)
         return
 
-    data = call.data or ""
     if ":" not in data:
+        await call.answer()
         return
     action, leader_id_str = data.split(":", 1)
 
     try:
         leader_id = int(leader_id_str)
     except:
+        await call.answer()
         return
 
-    allowed = (call.from_user.id == game["leader_id"]) or is_super(call)
-    if not allowed or leader_id != game["leader_id"]:
+    allowed = (call.from_user.id == s.leader_id) or is_super(call)
+    if not allowed or leader_id != s.leader_id:
         await call.answer("⛔ Только ведущий и @yakovlef.", show_alert=True)
         return
 
     if action == "show":
-        await call.answer(f"Твоё слово: {game['word']}", show_alert=True)
+        await call.answer(f"Твоё слово: {s.word}", show_alert=True)
 
     elif action == "replace":
-        if game["special"]:
+        if s.special:
             # в спец-режиме смена слова разрешена только супер-офицеру
             if not is_super(call):
                 await call.answer("⛔ В спец-раунде смена слова только для @yakovlef.", show_alert=True)
@@ -710,25 +3123,30 @@ async def callbacks(call: CallbackQuery):
             await call.answer("ℹ️ Для смены спец-слова используй /special <слово>.", show_alert=True)
             return
 
-        words = load_words_list()
-        w = pick_new_word(words)
+        if s.state != ROUND_ACTIVE:
+            await call.answer("Раунд уже завершается.", show_alert=True)
+            return
+        w = s.pick_new_word()
         if not w:
             await call.answer("Слова закончились!", show_alert=True)
             return
-        game["word"] = w
-        game["attempts"] = 0
+        journal.log("word_replace", s, leader=s.leader_id, old=s.word, new=w)
+        s.finish_word("replaced")
+        s.set_word(w)
+        s.arm_timer()   # у нового слова — полный срок
         await call.answer(f"Новое слово: {w}", show_alert=True)
 
     elif action == "pass":
-        await call.message.answer("Чтобы передать ход:\n/passlead @username")
+        send(call.message.answer("Чтобы передать ход:\n/passlead @username"))
         await call.answer()
 
     elif action == "stop":
         if not is_super(call):
             await call.answer("⛔ Остановить игру может только @yakovlef.", show_alert=True)
             return
-        game.update(active=False, word=None, leader_id=None, attempts=0, special=False)
-        await call.message.answer("⛔ Игра остановлена.")
+        async with s.lock:
+            s.stop_round()
+        send(call.message.answer("⛔ Игра остановлена."))
         await call.answer("Остановлено.")
 
 # =========================================================
@@ -738,59 +3156,78 @@ async def callbacks(call: CallbackQuery):
 # =========================================================
 @dp.message()
 async def on_guess(message: Message):
-    if not in_target_topic(message):
+    s = find_session(message)
+    if s is None:
         return
 
-    update_activity()
+    update_activity(s)
 
-    # если игра не активна — просто выходим
-    if not game["active"] or not game["word"]:
+    # вне активного раунда (в т.ч. пока засчитывается верный ответ) — выходим
+    if s.state != ROUND_ACTIVE:
         return
 
     # штраф за «однокоренные» / подсказки от ведущего
-    if message.from_user.id == game["leader_id"]:
-        if message.text and detect_root_violation(message.text, game["word"]):
+    if message.from_user.id == s.leader_id:
+        if message.text and s.matcher.roots.violated(message.text):
             # штрафные очки ведущему: -1 (не ниже 0)
-            lid = game["leader_id"]
-            scores[lid] = max(0, scores.get(lid, 0) - 1)
-            save_scores(scores)
-            await message.answer(
+            lid = s.leader_id
+            s.set_score(lid, max(0, s.scores.get(lid, 0) - 1))
+            journal.log("penalty", s, uid=lid, text=message.text, total=s.scores[lid])
+            send(message.answer(
                 f"⚠️ {mention_html(message.from_user)}, штраф -1 очко за однокоренное/подсказку!"
-            )
+            ), key=("penalty", lid))
         return
 
     if not message.text:
         return
 
-    guess = normalize(message.text)
-    answer = normalize(game["word"])
-
-    if not guess:
-        return
-
-    # при спец-слове можно засчитывать вхождение (на случай фраз)
-    is_correct = (guess == answer) or (answer in guess)
-
-    if not is_correct:
-        game["attempts"] += 1
+    s.join(message.from_user.id)
+    matcher = s.matcher
+    verdict = matcher.check(message.text)
+    guesses.inc(GUESS_NAMES[verdict])
+    if verdict != GUESS_HIT:
+        # сообщения без букв (смайлы, цифры) попыткой не считаем
+        if _HAS_LETTER.search(message.text):
+            s.attempts += 1
+            journal.log("guess", s, uid=message.from_user.id, text=message.text,
+                        result=GUESS_NAMES[verdict])
+        if verdict == GUESS_NEAR and message.from_user.id not in matcher.near_told:
+            matcher.near_told.add(message.from_user.id)
+            send(message.reply("🤏 Почти!"))
         return
 
     # ========= УГАДАЛ =========
+    # занимаем раунд до первого await: второй верный ответ сюда уже не дойдёт
+    s.state = ROUND_RESOLVING
+    try:
+        async with s.lock:
+            # пока ждали лок, раунд могли остановить или перезапустить
+            if s.state != ROUND_RESOLVING or s.matcher is not matcher:
+                return
+            await award_guess(s, message)
+    finally:
+        # award_guess сам переводит раунд дальше; сюда попадаем при ошибке отправки
+        if s.state == ROUND_RESOLVING and s.matcher is matcher:
+            s.state = ROUND_ACTIVE
+
+async def award_guess(s: GameSession, message: Message):
     user = message.from_user
     uid = user.id
 
-    reward = game["special_reward"] if game["special"] else 1
-    scores[uid] = scores.get(uid, 0) + reward
-    save_scores(scores)
+    reward = s.special_reward if s.special else 1
+    s.set_score(uid, s.scores.get(uid, 0) + reward)
+    journal.log("win", s, uid=uid, word=s.word, reward=reward,
+                attempts=s.attempts, total=s.scores[uid])
+    s.finish_word("guessed")
 
     # статистика угадываний
     stats["total_guessed"] = int(stats.get("total_guessed", 0)) + 1
     stats["today_guessed"] = int(stats.get("today_guessed", 0)) + 1
     stats["today_date"] = str(date.today())
-    save_stats(stats)
+    mark_dirty("stats")
 
     # похвала + ачивка
-    ach = achievement_for(scores[uid])
+    ach = achievement_for(s.scores[uid])
     praise = random.choice([
         "Красавчик! 😎",
         "Вот это скорость! 🔥",
@@ -800,103 +3237,172 @@ async def on_guess(message: Message):
     ])
 
     text = (
-        f"🎉 {mention_html(user)} угадал(а) слово <b>{game['word']}</b>!\n"
+        f"🎉 {mention_html(user)} угадал(а) слово <b>{s.word}</b>!\n"
         f"{praise}\n"
-        f"💎 +{reward} очк(а). Теперь у тебя: <b>{scores[uid]}</b>"
+        f"💎 +{reward} очк(а). Теперь у тебя: <b>{s.scores[uid]}</b>"
     )
     if ach:
         text += f"\n🏅 <b>Ачивка получена:</b> {ach}"
 
-    await message.answer(text)
+    send(message.answer(text), PRIO_HIGH)
 
     # если это был спец-раунд — он заканчивается, дальше обычный раунд
-    if game["special"]:
-        game.update(active=False, word=None, leader_id=None, attempts=0, special=False)
-        await message.answer("⭐ Спец-раунд завершён! Для продолжения жми /startgame.")
+    if s.special:
+        s.stop_round()
+        send(message.answer("⭐ Спец-раунд завершён! Для продолжения жми /startgame."), PRIO_HIGH)
         return
 
     # передаём ход угадчику
-    words = load_words_list()
-    new_word = pick_new_word(words)
+    new_word = s.pick_new_word()
 
     if not new_word:
-        game.update(active=False, word=None, leader_id=None, attempts=0, special=False)
-        await message.answer("🎉 Все слова закончились! Игра остановлена.")
+        s.stop_round()
+        send(message.answer("🎉 Все слова закончились! Игра остановлена."), PRIO_HIGH)
         return
 
-    game.update(
-        leader_id=uid,
-        word=new_word,
-        attempts=0
-    )
+    s.start_round(new_word, uid)
 
-    await message.answer(
+    send(message.answer(
         f"👉 Новый ведущий: {mention_html(user)}",
         reply_markup=leader_keyboard(uid)
-    )
+    ), PRIO_HIGH)
 
 # =========================================================
 #               ФОНОВЫЕ ЗАДАЧИ
 # =========================================================
-async def daily_report_loop():
+def next_daily_report(now: datetime | None = None) -> datetime:
+    """Ближайшие после now 21:00 серверного времени."""
+    now = now or datetime.now()
+    target = datetime.combine(now.date(), time(21, 0))
+    if now >= target:
+        target += timedelta(days=1)
+    return target
+
+def daily_report():
     """Раз в день пишет супер-офицеру сколько слов угадали за день."""
-    global SUPER_OFFICER_ID
-    while True:
-        try:
-            # ждём до 21:00 серверного времени
-            now = datetime.now()
-            target = datetime.combine(now.date(), time(21, 0))
-            if now >= target:
-                target += timedelta(days=1)
-            await asyncio.sleep((target - now).total_seconds())
-
-            stats_local = load_stats()
-            if SUPER_OFFICER_ID:
-                await bot.send_message(
-                    chat_id=SUPER_OFFICER_ID,
-                    text=f"📌 За сегодня угадано слов: <b>{stats_local.get('today_guessed',0)}</b>"
-                )
-
-            # обнуляем today
-            stats_local["today_guessed"] = 0
-            stats_local["today_date"] = str(date.today())
-            save_stats(stats_local)
-
-        except Exception as e:
-            logger.warning(f"daily_report_loop error: {e}")
-            await asyncio.sleep(60)
-
-async def inactivity_loop():
-    """Если >3 часов нет активности и игра не идёт — предложить сыграть."""
-    global last_activity_ts
-    while True:
-        await asyncio.sleep(60)
-        try:
-            if game["active"]:
-                continue
-            diff = datetime.now() - last_activity_ts
-            if diff.total_seconds() >= INACTIVITY_HOURS * 3600:
-                await bot.send_message(
-                    chat_id=CHAT_ID,
-                    message_thread_id=THREAD_ID if THREAD_ID != 0 else None,
-                    text="🐊 Давно не играли! Может сыграем в Крокодила? Жми /startgame 😄"
-                )
-                last_activity_ts = datetime.now()
-        except Exception as e:
-            logger.warning(f"inactivity_loop error: {e}")
+    # с запасом: таймер мог сработать на долю секунды раньше 21:00
+    scheduler.call_at("daily", next_daily_report(datetime.now() + timedelta(hours=1)), daily_report)
+
+    if SUPER_OFFICER_ID:
+        send(SendMessage(
+            chat_id=SUPER_OFFICER_ID,
+            text=f"📌 За сегодня угадано слов: <b>{stats.get('today_guessed',0)}</b>"
+        ).as_(bot))
+
+    # обнуляем today
+    journal.log("daily_report", guessed=stats.get("today_guessed", 0))
+    stats["today_guessed"] = 0
+    stats["today_date"] = str(date.today())
+    mark_dirty("stats")
 
 # =========================================================
 #                       ЗАПУСК
 # =========================================================
-async def main():
-    logger.info("✅ Бот запущен и готов к работе.")
-    await setup_commands()
+def start_background_tasks():
+    asyncio.create_task(scheduler.run())
+    asyncio.create_task(outbox.run())
+    asyncio.create_task(journal.run())
+    scheduler.call_at("daily", next_daily_report(), daily_report)
+    _refresh_admins_later(CHAT_ID)
+
+async def shutdown():
+    """Дослать очередь и сбросить состояние на диск."""
+    await outbox.drain()
+    await flush_state()
+    await journal.close()
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({
+        "status": "ok" if state_ready.is_set() else "loading",
+        "sessions": len(sessions),
+        "dirty": len(_dirty),
+    })
+
+def make_webhook_app() -> web.Application:
+    """
+    aiohttp-приложение: POST WEBHOOK_PATH — апдейты от Telegram
+    (с проверкой секрета), GET /health — для балансировщика.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    """Отдельный локальный сервер метрик — не светим их на публичном адресе вебхука."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/health", health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def run_webhook():
+    # сигналы ловим сами: так shutdown() успевает дослать очередь до отмены задач
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:   # Windows
+            pass
+
+    runner = web.AppRunner(make_webhook_app())
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await stop.wait()
+    finally:
+        # вебхук не снимаем: апдейты копятся у Telegram до следующего запуска
+        await runner.cleanup()
+
+async def warm_up():
+    """Загрузить состояние параллельно с подключением к Telegram, затем меню команд."""
+    await asyncio.to_thread(load_state)
+    update_activity(sessions[HOME])   # таймеры взводим уже в event loop
+    journal.snapshot()
+    journal.snapshot(sessions[HOME])
+    state_ready.set()
+    logger.info(f"✅ Бот готов к работе: старт занял {monotonic() - STARTED_AT:.2f} с.")
+    try:
+        await setup_commands()
+    except Exception as e:
+        logger.warning(f"setup_commands error: {e}")
+
+async def serve():
+    if WEBHOOK_URL:
+        await run_webhook()
+    else:
+        # вебхук мог остаться с прошлого запуска — polling с ним не работает
+        await bot.delete_webhook()
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
 
-    # запускаем фоновые задачи
-    asyncio.create_task(daily_report_loop())
-    asyncio.create_task(inactivity_loop())
+async def main():
+    logger.info("Бот запускается…")
+    start_background_tasks()
+    if METRICS_PORT:
+        await start_metrics_server()
 
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    try:
+        # ошибка загрузки состояния роняет бота, как раньше падал импорт
+        await asyncio.gather(warm_up(), serve())
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,48 @@
+"""
+Проверка и импорт списков слов в словарь бота — то же, что /importwords,
+но из консоли и без ограничения на размер файла.
+
+    python wordlist.py check new_words.txt      # только отчёт, словарь не трогаем
+    python wordlist.py import new_words.txt     # добавить новые слова
+    cat *.txt | python wordlist.py import -     # из stdin
+
+Запускать в папке бота с теми же STORAGE/DB_FILE, что и у него. Слова
+нормализуются (ё→е, без дефисов) и сверяются с индексом словаря, так что
+«ёж» не попадёт, если есть «еж». Запись атомарная; запущенный бот
+подхватит новые слова сам (words.txt/база проверяются раз в
+WORDS_RECHECK_SECONDS), перезапуск не нужен.
+"""
+import os
+import sys
+import argparse
+from time import perf_counter
+
+def main_cli(args):
+    # main.py требует токен при импорте; в Telegram отсюда ничего не уходит
+    os.environ.setdefault("BOT_TOKEN", "0:OFFLINE")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    import main
+    logging.disable(logging.INFO)
+
+    t = perf_counter()
+    dictionary = main.WordDictionary(main.make_storage())
+    dictionary.refresh(force=True)
+    counts = dict.fromkeys(main.IMPORT_COUNTERS, 0)
+
+    src = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8", errors="replace")
+    with src:
+        planned = list(main.import_words(src, dictionary, counts))
+    added = dictionary.add_many(planned) if args.command == "import" else planned
+
+    mode = " (проверка, словарь не изменён)" if args.command == "check" else ""
+    print(f"{args.file}{mode}: {main.import_report(counts, len(added))}")
+    print(f"в словаре {len(dictionary)} слов ({main.STORAGE}), {perf_counter() - t:.2f} с")
+    if args.command == "check" and added:
+        print("новые:", ", ".join(added[:20]) + (" …" if len(added) > 20 else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка и импорт списков слов")
+    parser.add_argument("command", choices=["check", "import"])
+    parser.add_argument("file", help="файл со словами (по слову на строку или через запятую), - для stdin")
+    main_cli(parser.parse_args())